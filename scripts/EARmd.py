@@ -17,11 +17,26 @@ WriteToGoogle on any outputs you want to share to get a viewable/downloadable li
 
 
 import pandas as pd
+from pandas._libs.parsers import STR_NA_VALUES
+import numpy as np
 import csv
+import fnmatch
 import gzip
+import hashlib
+import io
+import json
 import os
+import re
 import requests
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
 import xlsxwriter
+from email.utils import formatdate
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
 from lxml import etree
@@ -29,7 +44,9 @@ import sys
 import logging
 from IPython.core.display import display, HTML
 
+import collections
 import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from plotly import tools
 import plotly.plotly
 from _plotly_future_ import v4
@@ -42,6 +59,25 @@ init_notebook_mode(connected=True)
 from PIL import Image
 Image.MAX_IMAGE_PIXELS = None
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pacsv = None
+    pq = None
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+
 lggr = logging.getLogger(__name__)
 csv.field_size_limit(sys.maxsize)
 
@@ -49,11 +85,167 @@ csv.field_size_limit(sys.maxsize)
 # function to download metadata
 
 
-def get_records(urls, xml_files, well_formed=True):
+def _downloadSession(workers, retries, backoff):
+    """A requests session with a connection pool for ``workers`` threads
+    that retries failed requests with exponential backoff.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff,
+                  status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# the options of every parser of records, so that whatever reads a record
+# as well-formed can also evaluate it
+PARSER_OPTIONS = {'remove_comments': False, 'huge_tree': True}
+
+
+class _DiscardTarget(object):
+    """lxml parser target that keeps nothing, so that feeding a parser
+    only checks well-formedness and does not build a tree.
+    """
+
+    def close(self):
+        return None
+
+
+def _checkWellFormed(chunks):
+    """Feed the chunks of a record to a parser that keeps nothing, raising
+    XMLSyntaxError if the record is not well-formed.
+    """
+    parser = etree.XMLParser(target=_DiscardTarget(), **PARSER_OPTIONS)
+    for chunk in chunks:
+        parser.feed(chunk)
+    parser.close()
+
+
+def _readChunks(chunks):
+    """Read the chunks of a record without looking at them."""
+    for _ in chunks:
+        pass
+
+
+def _savedChunks(chunks, f):
+    """Pass chunks through, writing them to the file ``f``."""
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+
+def _fetchRecord(session, url, fname, consume, validator, timeout,
+                 chunk_size):
+    """Download one metadata record. The response body is streamed
+    ``chunk_size`` bytes at a time to ``consume``, which must read it to the
+    end and rejects the record by raising XMLSyntaxError. When ``fname``
+    is given the body is also written to a temporary file, renamed to
+    ``fname`` once complete, so the file holds exactly the bytes that were
+    received; when the record was downloaded before, the request is made
+    conditional on it having changed. Returns the outcome, the validators
+    (ETag, Last-Modified) of the response and what ``consume`` returned.
+    """
+    headers = {}
+    if fname is not None and os.path.exists(fname):
+        if validator and 'ETag' in validator:
+            headers['If-None-Match'] = validator['ETag']
+        if validator and 'Last-Modified' in validator:
+            headers['If-Modified-Since'] = validator['Last-Modified']
+        else:
+            headers['If-Modified-Since'] = formatdate(
+                os.path.getmtime(fname), usegmt=True)
+    try:
+        r = session.get(url, headers=headers, timeout=timeout, stream=True)
+        if r.status_code == 304:
+            r.close()
+            return 'not modified', validator, None
+        r.raise_for_status()
+    except requests.RequestException:
+        print('There was an error downloading from {}'.format(url))
+        return 'failed', validator, None
+
+    part = None
+    if fname is not None:
+        part = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(fname) or '.',
+            prefix='.' + os.path.basename(fname), suffix='.part',
+            delete=False)
+    try:
+        with r:
+            chunks = r.iter_content(chunk_size)
+            if part is None:
+                result = consume(chunks)
+            else:
+                with part:
+                    result = consume(_savedChunks(chunks, part))
+    except requests.RequestException:
+        if part is not None:
+            os.remove(part.name)
+        print('There was an error downloading from {}'.format(url))
+        return 'failed', validator, None
+    except etree.XMLSyntaxError:
+        if part is not None:
+            os.remove(part.name)
+        print('Metadata record from {} not well-formed'.format(url))
+        return 'not well-formed', validator, None
+    if part is not None:
+        os.replace(part.name, fname)
+
+    validator = {name: r.headers[name] for name in ('ETag', 'Last-Modified')
+                 if name in r.headers}
+    return 'downloaded', validator, result
+
+
+def _fetchRecords(urls, fnames, consumers, workers, retries, backoff, timeout,
+                  validators, session, chunk_size):
+    """Download records with _fetchRecord, ``workers`` at a time, keeping
+    their validators in the json file ``validators``. Yields the outcome
+    and the result of the consumer for each URL, in order and as soon as
+    it is ready, so that results do not pile up; the validators are saved
+    once every URL has been yielded.
+    """
+    cache = {}
+    if validators is not None and os.path.exists(validators):
+        with open(validators, 'r') as f:
+            cache = json.load(f)
+    if session is None:
+        session = _downloadSession(workers, retries, backoff)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = _orderedResults(
+            executor,
+            lambda task: _fetchRecord(session, task[0], task[1], task[2],
+                                      cache.get(task[0]), timeout, chunk_size),
+            zip(urls, fnames, consumers), 2 * workers)
+        for url, (outcome, validator, result) in zip(urls, results):
+            if validator:
+                cache[url] = validator
+            yield outcome, result
+    if validators is not None:
+        with open(validators, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+
+
+def get_records(urls, xml_files, well_formed=True, workers=8, retries=3,
+                backoff=0.5, timeout=60, validators=None, session=None,
+                chunk_size=1 << 16):
     """Download metadata records. Metadata records are download from the
     supplied ``urls`` and stored in files whose names are found on
     ``xml_files``. When ``well_formed`` is ``True`` downloaded XML will
     be saved to a file only if well-formed.
+
+    Records are downloaded by ``workers`` threads sharing one pooled
+    ``session``; failed requests are retried ``retries`` times with
+    exponential ``backoff``. Records that already exist are only
+    downloaded again if they changed on the server. The ETag and
+    Last-Modified headers used for that are kept in the json file
+    ``validators``, when given, otherwise the file time is used. Records
+    are streamed to disk as raw bytes, ``chunk_size`` at a time, and
+    replace the previous file only once complete. Returns
+    the outcome for each URL: ``'downloaded'``, ``'not modified'``,
+    ``'not well-formed'`` or ``'failed'``.
     """
     """ if we used a function
     like this to collect xml, it would be the root of any processing steps
@@ -61,25 +253,1157 @@ def get_records(urls, xml_files, well_formed=True):
     if len(urls) != len(xml_files):
         raise ValueError('Different number of URLs and record file names')
 
-    for url, fname in zip(urls, xml_files):
-        try:
-            r = requests.get(url)
-            r.raise_for_status()
-            
-        except Exception:
-            print('There was an error downloading from {}'.format(url))
+    xml_files = [fname if fname[-4:] == '.xml' else fname + '.xml'
+                 for fname in xml_files]
+    consume = _checkWellFormed if well_formed else _readChunks
+    fetched = _fetchRecords(urls, xml_files, [consume] * len(urls), workers,
+                            retries, backoff, timeout, validators, session,
+                            chunk_size)
 
-        if well_formed:
-            try:
-                etree.fromstring(r.text)
-            except Exception:
-                print('Metadata record from {} not well-formed'.format(url))
+    return [outcome for outcome, _ in fetched]
+
+
+# functions to evaluate metadata
+
+
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+EVALUATED_COLUMNS = ['Collection', 'Record', 'XPath', 'Content']
+# the identity columns repeat on every row and are loaded as categoricals
+EVALUATED_DTYPES = {'Collection': 'category', 'Record': 'category',
+                    'XPath': 'category', 'Content': str}
+
+_xpathIndex = re.compile(r'\[\d*\]')
+_xmlSpace = re.compile(r'[ \t\r\n]+')
+
+
+def _normalizeSpace(text):
+    """XPath normalize-space(): collapse runs of XML whitespace and trim
+    the ends. Unlike ``str.split`` it leaves other unicode spaces alone.
+    """
+    return _xmlSpace.sub(' ', text).strip(' \t\r\n')
+
+
+def _qualifiedName(name, prefix):
+    """Lexical name of an element or attribute as it would be written in
+    the record, i.e. ``prefix:local`` or ``local``.
+    """
+    if name[0] == '{':
+        name = name.split('}', 1)[1]
+    if prefix:
+        return prefix + ':' + name
+    return name
+
+
+def _attributePrefix(elem, name):
+    """Find the prefix in scope on ``elem`` for a namespaced attribute."""
+    uri = name[1:].split('}', 1)[0]
+    if uri == XML_NAMESPACE:
+        return 'xml'
+    for prefix, nsuri in elem.nsmap.items():
+        if prefix and nsuri == uri:
+            return prefix
+    return None
+
+
+def evaluateEvents(events, collectionName, recordName):
+    """Produce the ``Collection, Record, XPath, Content`` rows of one
+    record from a stream of lxml ``(event, element)`` pairs. ``events``
+    must contain both ``start`` and ``end`` events, as produced by
+    ``etree.iterparse`` or ``etree.XMLPullParser``.
+
+    Rows match the output of AllNodes.xsl: one row for every element
+    whose first non-blank text node has content, one for each of its
+    attributes, in document order, with position predicates removed from
+    the XPath. Elements are cleared once they have been evaluated, so
+    memory only grows with the number of rows of the record.
+    """
+    rows = []
+    # one frame per open element: [path, row slot, child string values]
+    stack = []
+    for event, elem in events:
+        if event == 'start':
+            tag = elem.tag
+            if not isinstance(tag, str):
+                continue
+            path = (stack[-1][0] if stack else '') + '/' + _qualifiedName(
+                tag, elem.prefix if tag[0] == '{' else None)
+            stack.append([path, len(rows), []])
+            rows.append(None)
+            for name, value in elem.attrib.items():
+                prefix = _attributePrefix(elem, name) if name[0] == '{' else None
+                rows.append((
+                    collectionName, recordName,
+                    path + '/@' + _qualifiedName(name, prefix),
+                    _normalizeSpace(value.replace('"', ''))
+                ))
+        elif event == 'end':
+            if not isinstance(elem.tag, str):
+                continue
+            path, slot, childValues = stack.pop()
+            # the string value of the element is all of its descendant text,
+            # rebuilt from the values of the already cleared children
+            ownText = [elem.text or '']
+            value = [elem.text or '']
+            childValues = iter(childValues)
+            for child in elem:
+                if isinstance(child.tag, str):
+                    value.append(next(childValues))
+                if child.tail:
+                    ownText.append(child.tail)
+                    value.append(child.tail)
+            value = ''.join(value)
+            if any(_normalizeSpace(text) for text in ownText):
+                rows[slot] = (
+                    collectionName, recordName, path,
+                    _normalizeSpace(_xpathIndex.sub('', value)).replace('"', '')
+                )
+            if stack:
+                stack[-1][2].append(value)
+            elem.clear(keep_tail=True)
+    return [row for row in rows if row is not None]
+
+
+def evaluateRecord(source, collectionName, recordName):
+    """Evaluate a single XML record. ``source`` is a file name or a binary
+    file object. Returns the list of evaluation rows for the record.
+    """
+    events = etree.iterparse(source, events=('start', 'end'),
+                             **PARSER_OPTIONS)
+    return evaluateEvents(events, collectionName, recordName)
+
+
+def _pullEvents(chunks):
+    """Parse a record arriving in chunks, yielding the ``start`` and
+    ``end`` events of each chunk as soon as it has been fed.
+    """
+    parser = etree.XMLPullParser(events=('start', 'end'), **PARSER_OPTIONS)
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event in parser.read_events():
+            yield event
+    parser.close()
+    for event in parser.read_events():
+        yield event
+
+
+ARCHIVE_SUFFIXES = ['.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tar', '.zip']
+
+
+def _recordSource(recordSetPath):
+    """``'directory'``, ``'zip'`` or ``'tar'``: where the records of a
+    collection are kept.
+    """
+    if os.path.isdir(recordSetPath):
+        return 'directory'
+    if zipfile.is_zipfile(recordSetPath):
+        return 'zip'
+    if tarfile.is_tarfile(recordSetPath):
+        return 'tar'
+    raise ValueError(
+        '%s is not a directory, zip or tar archive' % recordSetPath)
+
+
+def _collectionName(recordSetPath):
+    """Name of a collection: the name of its directory or archive."""
+    collectionName = os.path.basename(os.path.normpath(recordSetPath))
+    for suffix in ARCHIVE_SUFFIXES:
+        if collectionName.endswith(suffix) and os.path.isfile(recordSetPath):
+            return collectionName[:-len(suffix)]
+    return collectionName
+
+
+def _memberName(name):
+    """Record name of an archive member: its path in the archive."""
+    return name[2:] if name.startswith('./') else name
+
+
+def _isArchiveRecord(name, patterns):
+    """Whether an archive member is a record: a file whose name matches
+    one of ``patterns``, and not one of the resource forks macOS adds.
+    """
+    fileName = name.rsplit('/', 1)[-1]
+    if name.startswith('__MACOSX/') or fileName.startswith('._'):
+        return False
+    return any(fnmatch.fnmatch(fileName, pattern) for pattern in patterns)
+
+
+def _archiveMembers(recordSetPath):
+    """Yield ``(name, size, mtime, read)`` for the files of a zip or tar
+    archive, in archive order, ``read()`` returning the content of the
+    member. Compressed tarballs are read in a single streaming pass, so a
+    member can only be read before the next one is asked for.
+    """
+    if _recordSource(recordSetPath) == 'zip':
+        with zipfile.ZipFile(recordSetPath) as archive:
+            for info in archive.infolist():
+                if not info.filename.endswith('/'):
+                    yield (_memberName(info.filename), info.file_size,
+                           time.mktime(info.date_time + (0, 0, -1)),
+                           lambda info=info: archive.read(info))
+        return
+    with tarfile.open(recordSetPath, 'r|*') as archive:
+        for member in archive:
+            if member.isfile():
+                yield (_memberName(member.name), member.size, member.mtime,
+                       archive.extractfile(member).read)
+
+
+def _archiveContents(recordSetPath, select):
+    """Yield ``(record, content, size, mtime)`` for the members of a zip
+    or tar archive for which ``select(name)`` is true, in archive order.
+    Members are read straight from the archive, nothing is extracted.
+    """
+    for name, size, mtime, read in _archiveMembers(recordSetPath):
+        if select(name):
+            yield name, read(), size, mtime
+
+
+def collectionRecords(recordSetPath, fileNamePattern='*.xml'):
+    """List the records of a collection, the way the ``collection()`` call
+    of AllNodes.xsl selects them: every file whose name matches one of the
+    space separated ``fileNamePattern`` globs. ``recordSetPath`` is a
+    directory or a zip or tar (optionally compressed) archive; the records
+    of an archive are its matching members, named by their path in the
+    archive, in archive order.
+    """
+    source = _recordSource(recordSetPath)
+    if source != 'directory':
+        patterns = fileNamePattern.split()
+        return [name for name, _, _, _ in _archiveMembers(recordSetPath)
+                if _isArchiveRecord(name, patterns)]
+
+    names = sorted(
+        name for name in os.listdir(recordSetPath)
+        if os.path.isfile(os.path.join(recordSetPath, name))
+    )
+    records = []
+    for pattern in fileNamePattern.split():
+        records.extend(name for name in fnmatch.filter(names, pattern)
+                       if name not in records)
+    return records
+
+
+def _evaluatedLine(row):
+    """Format an evaluation row as AllNodes.xsl writes it."""
+    return '%s,%s,%s,"%s"\n' % row
+
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+STORE_SUFFIXES = {'parquet': '.parquet', 'arrow': '.arrows'}
 
-        if fname[-4:] != '.xml':
-            fname += '.xml'
 
-        with open(fname, 'wt') as f:
-            f.write(r.text)
+def _storeFormat(path):
+    """``'parquet'``, ``'arrow'`` (Arrow IPC stream) or ``'csv'``, from the
+    suffix of an evaluated store.
+    """
+    for name, suffix in STORE_SUFFIXES.items():
+        if path.endswith(suffix):
+            return name
+    return 'csv'
+
+
+def _compressionCodec(path, codec=None):
+    """The codec to use for ``path``, guessed from its suffix unless one
+    is given.
+    """
+    if codec is not None:
+        if codec not in COMPRESSION_SUFFIXES:
+            raise ValueError('Unknown compression codec %s' % codec)
+        return codec
+    for name, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return name
+    return None
+
+
+def _openEvaluated(path, mode, codec=None, compressionLevel=None):
+    """Open an evaluated csv for text reading (``'r'``) or writing
+    (``'w'``), compressing or decompressing on the fly with ``codec``.
+    """
+    codec = _compressionCodec(path, codec)
+    if codec is None:
+        return open(path, mode, encoding='utf-8', newline='')
+    if codec == 'gzip':
+        if compressionLevel is None:
+            compressionLevel = 9
+        stream = gzip.open(path, mode + 'b', compresslevel=compressionLevel)
+    else:
+        if zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package')
+        if mode == 'w':
+            if compressionLevel is None:
+                compressionLevel = 3
+            stream = zstandard.ZstdCompressor(
+                level=compressionLevel).stream_writer(open(path, 'wb'))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                open(path, 'rb'))
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+def evaluatedLocation(DataDirectory, collectionName, codec=None,
+                      storeFormat='csv'):
+    """Where the evaluated store of a collection is kept in
+    ``DataDirectory``.
+    """
+    if storeFormat == 'csv':
+        suffix = '.csv' + COMPRESSION_SUFFIXES.get(codec, '')
+    else:
+        suffix = STORE_SUFFIXES[storeFormat]
+    return os.path.join(DataDirectory, collectionName + '_XpathEvaluated' + suffix)
+
+
+def findEvaluated(DataDirectory, collectionName):
+    """The evaluated store of a collection in ``DataDirectory``, whatever
+    its format. Falls back to the gzipped csv location when there is none.
+    """
+    for storeFormat, codec in [('parquet', None), ('arrow', None),
+                               ('csv', 'gzip'), ('csv', 'zstd'), ('csv', None)]:
+        location = evaluatedLocation(DataDirectory, collectionName, codec,
+                                     storeFormat)
+        if os.path.exists(location):
+            return location
+    return evaluatedLocation(DataDirectory, collectionName, 'gzip')
+
+
+def _evaluatedSchema():
+    """Arrow schema of a columnar evaluated store. The identity columns,
+    which repeat on every row, are dictionary encoded.
+    """
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([pa.field(column, dictionary)
+                      for column in EVALUATED_COLUMNS[:3]] +
+                     [pa.field('Content', pa.string())])
+
+
+def _evaluatedBatch(rows, schema):
+    """Build a record batch from a list of evaluation rows."""
+    columns = list(zip(*rows))
+    arrays = [pa.array(columns[i], pa.string()).dictionary_encode()
+              for i in range(3)]
+    arrays.append(pa.array(columns[3], pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _writeEvaluatedTable(rows, DataDestination, storeFormat, codec=None,
+                         compressionLevel=None, chunkRows=10000):
+    """Write evaluation rows to a Parquet file or an Arrow IPC stream,
+    one record batch of ``chunkRows`` rows at a time. ``codec`` is the
+    Parquet or IPC compression codec.
+    """
+    if pa is None:
+        raise ImportError('Parquet and Arrow stores require the pyarrow package')
+    schema = _evaluatedSchema()
+    if storeFormat == 'parquet':
+        writer = pq.ParquetWriter(DataDestination, schema,
+                                  compression=codec or 'snappy',
+                                  compression_level=compressionLevel)
+    else:
+        writer = pa.ipc.new_stream(
+            DataDestination, schema,
+            options=pa.ipc.IpcWriteOptions(compression=codec))
+    try:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunkRows:
+                writer.write_batch(_evaluatedBatch(chunk, schema))
+                chunk = []
+        if chunk:
+            writer.write_batch(_evaluatedBatch(chunk, schema))
+    finally:
+        writer.close()
+
+
+def _evaluatedBatches(XpathEvaluated, columns=None):
+    """Iterate over the record batches of a columnar evaluated store,
+    reading only ``columns``.
+    """
+    if pa is None:
+        raise ImportError('Parquet and Arrow stores require the pyarrow package')
+    if _storeFormat(XpathEvaluated) == 'parquet':
+        for batch in pq.ParquetFile(XpathEvaluated).iter_batches(columns=columns):
+            yield batch
+        return
+    with pa.ipc.open_stream(XpathEvaluated) as reader:
+        for batch in reader:
+            if columns is not None:
+                batch = pa.RecordBatch.from_arrays(
+                    [batch.column(column) for column in columns], names=columns)
+            yield batch
+
+
+def _readEvaluatedCsv(XpathEvaluated, columns=None, **kwargs):
+    return pd.read_csv(XpathEvaluated, usecols=columns,
+                       dtype=EVALUATED_DTYPES, **kwargs)
+
+
+def _readEvaluatedArrowCsv(XpathEvaluated, columns=None):
+    """Read an evaluated csv with the pyarrow parser. Every column is
+    parsed as text, so Content such as "001" or "1.50" is kept as it is,
+    and the values the C parser takes for missing are missing, so both
+    engines give the same frame.
+    """
+    if pa is None:
+        raise ImportError('The pyarrow engine requires the pyarrow package')
+    table = pacsv.read_csv(XpathEvaluated, convert_options=pacsv.ConvertOptions(
+        column_types={column: pa.string() for column in EVALUATED_COLUMNS},
+        include_columns=[column for column in EVALUATED_COLUMNS
+                         if columns is None or column in columns],
+        strings_can_be_null=True,
+        null_values=sorted(STR_NA_VALUES)))
+    return _evaluatedFrame(table)
+
+
+def readEvaluated(XpathEvaluated, columns=None, engine='c'):
+    """Load an evaluated store, csv (optionally compressed), Parquet or
+    Arrow IPC stream, into a dataframe with the types of EVALUATED_DTYPES:
+    Collection, Record and XPath are categoricals and Content is text.
+    ``columns`` restricts the columns that are read; stages that only look
+    at the structure of the records should leave out ``Content``.
+    ``engine`` is the pandas csv parser, 'c' or 'pyarrow'.
+    """
+    storeFormat = _storeFormat(XpathEvaluated)
+    if storeFormat == 'csv':
+        if engine == 'pyarrow':
+            return _readEvaluatedArrowCsv(XpathEvaluated, columns)
+        return _readEvaluatedCsv(XpathEvaluated, columns, engine=engine)
+    if pa is None:
+        raise ImportError('Parquet and Arrow stores require the pyarrow package')
+    if storeFormat == 'parquet':
+        table = pq.read_table(XpathEvaluated, columns=columns)
+    else:
+        table = pa.Table.from_batches(
+            list(_evaluatedBatches(XpathEvaluated, columns)),
+            schema=_evaluatedColumnsSchema(columns))
+    return _evaluatedFrame(table)
+
+
+def _evaluatedColumnsSchema(columns=None):
+    schema = _evaluatedSchema()
+    if columns is not None:
+        schema = pa.schema([schema.field(column) for column in columns])
+    return schema
+
+
+def _evaluatedFrame(table):
+    """Dataframe of a table of evaluation rows, with the types of
+    EVALUATED_DTYPES.
+    """
+    schema = _evaluatedSchema()
+    table = table.cast(pa.schema(
+        [schema.field(name) for name in table.column_names]))
+    frame = table.to_pandas()
+    # sorted categories, as read from csv, so records and XPaths group in
+    # the same order whatever the store
+    for column in frame.columns:
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            frame[column] = frame[column].cat.reorder_categories(
+                frame[column].cat.categories.sort_values())
+    return frame
+
+
+# rows read to estimate the memory a row takes, and the factor between the
+# memory of a chunk and the memory used to aggregate it
+PROBE_ROWS = 10000
+CHUNK_OVERHEAD = 4
+DEFAULT_MEMORY_BUDGET = 1 << 30
+
+
+def _budgetRows(chunk, memoryBudget):
+    """Number of rows like those of ``chunk`` that fit, with the work done
+    on them, in ``memoryBudget`` bytes.
+    """
+    rowBytes = chunk.memory_usage(index=True, deep=True).sum() / max(len(chunk), 1)
+    return max(1, int(memoryBudget / (rowBytes * CHUNK_OVERHEAD)))
+
+
+def readEvaluatedChunks(XpathEvaluated, columns=None, memoryBudget=None,
+                        chunkRows=100000):
+    """Iterate over an evaluated store, like readEvaluated, in dataframes
+    of ``chunkRows`` rows. With a ``memoryBudget``, in bytes, the number of
+    rows of a chunk is set from the memory taken by the first rows, so that
+    a chunk and its aggregation fit in the budget.
+    """
+    rows = PROBE_ROWS if memoryBudget is not None else chunkRows
+    storeFormat = _storeFormat(XpathEvaluated)
+    if storeFormat == 'csv':
+        with _readEvaluatedCsv(XpathEvaluated, columns, iterator=True) as reader:
+            while True:
+                try:
+                    chunk = reader.get_chunk(rows)
+                except StopIteration:
+                    return
+                if memoryBudget is not None:
+                    rows = _budgetRows(chunk, memoryBudget)
+                    memoryBudget = None
+                yield chunk
+    if pa is None:
+        raise ImportError('Parquet and Arrow stores require the pyarrow package')
+
+    schema = _evaluatedColumnsSchema(columns)
+    batches = []
+    batchRows = 0
+    for batch in _evaluatedBatches(XpathEvaluated, columns):
+        batches.append(batch)
+        batchRows += batch.num_rows
+        if batchRows < rows:
+            continue
+        table = pa.Table.from_batches(batches, schema=schema)
+        while table.num_rows >= rows:
+            chunk = _evaluatedFrame(table.slice(0, rows))
+            table = table.slice(rows)
+            if memoryBudget is not None:
+                rows = _budgetRows(chunk, memoryBudget)
+                memoryBudget = None
+            yield chunk
+        batches = table.to_batches()
+        batchRows = table.num_rows
+    if batchRows:
+        yield _evaluatedFrame(pa.Table.from_batches(batches, schema=schema))
+
+
+def _recordChunks(chunks):
+    """Regroup chunks of evaluation rows so that each holds whole records:
+    the rows of the last record of a chunk are carried over to the next
+    chunk. The rows of a record must be contiguous, as in the evaluated
+    stores; ValueError is raised otherwise.
+    """
+    finished = set()
+    carried = None
+    for chunk in chunks:
+        if carried is not None:
+            chunk = pd.concat([carried, chunk], ignore_index=True)
+        if not len(chunk):
+            continue
+        records = chunk['Record'].to_numpy()
+        others = np.flatnonzero(records != records[-1])
+        start = others[-1] + 1 if len(others) else 0
+        carried = chunk.iloc[start:]
+        if start:
+            yield _finishedRecords(chunk.iloc[:start], finished)
+    if carried is not None and len(carried):
+        yield _finishedRecords(carried, finished)
+
+
+def _finishedRecords(chunk, finished):
+    records = pd.unique(chunk['Record'])
+    if any(record in finished for record in records):
+        raise ValueError('The rows of a record are not contiguous, '
+                         'it cannot be read in chunks')
+    finished.update(records)
+    return chunk
+
+
+def _writeEvaluated(rows, DataDestination, codec=None, compressionLevel=None,
+                    chunkRows=10000):
+    """Write evaluation rows to ``DataDestination`` as csv. The rows are
+    compressed as they are written when a ``codec`` is given or the file
+    name ends in .gz or .zst, so the uncompressed csv never touches the
+    disk. Rows are handed to the writer ``chunkRows`` at a time. Files
+    ending in .parquet or .arrows are written as columnar stores instead.
+    """
+    storeFormat = _storeFormat(DataDestination)
+    if storeFormat != 'csv':
+        _writeEvaluatedTable(rows, DataDestination, storeFormat, codec,
+                             compressionLevel, chunkRows)
+        return
+    with _openEvaluated(DataDestination, 'w', codec, compressionLevel) as f:
+        f.write(','.join(EVALUATED_COLUMNS) + '\n')
+        lines = []
+        for row in rows:
+            lines.append(_evaluatedLine(row))
+            if len(lines) == chunkRows:
+                f.writelines(lines)
+                lines = []
+        f.writelines(lines)
+
+
+def _tryEvaluateRecord(source, collectionName, record):
+    """Evaluate one record of a collection. Records that are not
+    well-formed are logged and produce no rows.
+    """
+    try:
+        return evaluateRecord(source, collectionName, record)
+    except etree.XMLSyntaxError as err:
+        lggr.warning('Skipping %s, not well-formed: %s' % (record, err))
+        return []
+
+
+def _recordSignature(path):
+    """Content hash, size and modification time of a record file."""
+    stat = os.stat(path)
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return {'sha256': sha.hexdigest(), 'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def _contentSignature(content, size, mtime):
+    """Content hash, size and modification time of an archived record."""
+    return {'sha256': hashlib.sha256(content).hexdigest(), 'size': size,
+            'mtime': mtime}
+
+
+def _evaluateContents(contents, collectionName, entries=None):
+    """Yield the evaluation rows of archived records, as produced by
+    _archiveContents. When ``entries`` is given the manifest entry of each
+    record is stored in it.
+    """
+    for record, content, size, mtime in contents:
+        rows = _tryEvaluateRecord(io.BytesIO(content), collectionName, record)
+        if entries is not None:
+            entries[record] = _contentSignature(content, size, mtime)
+            entries[record]['rows'] = len(rows)
+        for row in rows:
+            yield row
+
+
+def _evaluateRecords(recordSetPath, records, collectionName, entries=None):
+    """Yield the evaluation rows of ``records`` of a directory, one record
+    at a time. When ``entries`` is given the manifest entry of each
+    record, its signature and number of rows, is stored in it.
+    """
+    for record in records:
+        path = os.path.join(recordSetPath, record)
+        rows = _tryEvaluateRecord(path, collectionName, record)
+        if entries is not None:
+            entries[record] = _recordSignature(path)
+            entries[record]['rows'] = len(rows)
+        for row in rows:
+            yield row
+
+
+def _statChanged(entry, size, mtime):
+    """Whether a record is new, without a manifest ``entry``, or its size
+    or modification time changed.
+    """
+    return entry is None or (entry['size'], entry['mtime']) != (size, mtime)
+
+
+def _recordSignatures(recordSetPath, fileNamePattern, previous):
+    """List the records of a collection and hash those that are new or
+    whose size or time changed since the manifest records ``previous``.
+    Archives are read in a single pass over their members, and the
+    content of the records whose hash changed is kept so that they can be
+    evaluated without reading the archive again. Returns the records, the
+    signatures of the hashed records and, for archives, the
+    ``(content, size, mtime)`` of the changed records.
+    """
+    if _recordSource(recordSetPath) == 'directory':
+        records = collectionRecords(recordSetPath, fileNamePattern)
+        signatures = {}
+        for record in records:
+            path = os.path.join(recordSetPath, record)
+            stat = os.stat(path)
+            if _statChanged(previous.get(record), stat.st_size, stat.st_mtime):
+                signatures[record] = _recordSignature(path)
+        return records, signatures, None
+
+    patterns = fileNamePattern.split()
+    records = []
+    signatures = {}
+    contents = {}
+    for record, size, mtime, read in _archiveMembers(recordSetPath):
+        if not _isArchiveRecord(record, patterns):
+            continue
+        records.append(record)
+        entry = previous.get(record)
+        if _statChanged(entry, size, mtime):
+            content = read()
+            signature = _contentSignature(content, size, mtime)
+            signatures[record] = signature
+            if entry is None or entry['sha256'] != signature['sha256']:
+                contents[record] = (content, size, mtime)
+    return records, signatures, contents
+
+
+def manifestLocation(DataDestination):
+    """The manifest of an evaluated store is kept next to it."""
+    return DataDestination + '.manifest.json'
+
+
+def readManifest(DataDestination):
+    """Read the record manifest of an evaluated store. The manifest maps
+    each record name to its ``sha256``, ``size``, ``mtime`` and number of
+    evaluated ``rows``. Returns ``None`` when there is no usable manifest.
+    """
+    try:
+        with open(manifestLocation(DataDestination), 'r') as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if not os.path.exists(DataDestination):
+        return None
+    return manifest
+
+
+def _writeManifest(DataDestination, collectionName, entries):
+    """Replace the manifest of an evaluated store."""
+    manifest = manifestLocation(DataDestination)
+    with open(manifest + '.tmp', 'w') as f:
+        json.dump({'Collection': collectionName, 'Records': entries}, f,
+                  indent=1, sort_keys=True)
+    os.replace(manifest + '.tmp', manifest)
+
+
+def evaluateCollection(recordSetPath, DataDestination, collectionName=None,
+                       fileNamePattern='*.xml', codec=None,
+                       compressionLevel=None):
+    """Evaluate every record of a collection and write the
+    ``Collection,Record,XPath,Content`` csv to ``DataDestination``. This
+    is a native replacement for running AllNodes.xsl with Saxon. The
+    collection is a directory or a zip or tar archive, whose records are
+    evaluated without being extracted. The collection name defaults to
+    the name of the directory or archive. The csv is
+    compressed while it is written with ``codec`` (``'gzip'`` or
+    ``'zstd'``), by default chosen from the suffix of ``DataDestination``.
+    A ``DataDestination`` ending in .parquet or .arrows is written as a
+    Parquet file or Arrow IPC stream with dictionary encoded identity
+    columns; ``codec`` is then the codec of that format.
+    """
+    recordSetPath = os.path.normpath(recordSetPath)
+    if collectionName is None:
+        collectionName = _collectionName(recordSetPath)
+    DataDestinationDirectory = os.path.dirname(DataDestination)
+    if DataDestinationDirectory:
+        os.makedirs(DataDestinationDirectory, exist_ok=True)
+
+    lggr.info('Evaluating %s' % collectionName)
+    entries = {}
+    if _recordSource(recordSetPath) != 'directory':
+        # read the archive once instead of listing it first
+        patterns = fileNamePattern.split()
+        rows = _evaluateContents(
+            _archiveContents(recordSetPath,
+                             lambda name: _isArchiveRecord(name, patterns)),
+            collectionName, entries)
+    else:
+        rows = _evaluateRecords(
+            recordSetPath, collectionRecords(recordSetPath, fileNamePattern),
+            collectionName, entries)
+    _writeEvaluated(rows, DataDestination, codec, compressionLevel)
+    _writeManifest(DataDestination, collectionName, entries)
+
+    return DataDestination
+
+
+def _evaluatePart(task):
+    """Worker for evaluateCollections. Evaluates a slice of a collection's
+    records, given by name or, for archives, with their content, and
+    writes the rows to a part file. Returns the manifest entries of the
+    records along with the collection and part.
+    """
+    index, recordSetPath, collectionName, partPath, records, contents = task
+    entries = {}
+    if contents is None:
+        rows = _evaluateRecords(recordSetPath, records, collectionName, entries)
+    else:
+        rows = _evaluateContents(contents, collectionName, entries)
+    with open(partPath, 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return index, partPath, entries
+
+
+def _batches(iterable, size):
+    """Split an iterable into lists of ``size`` items."""
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
+
+
+def _evaluationTasks(evaluations, partDirectory, recordsPerTask,
+                     fileNamePattern):
+    """Generate the tasks of evaluateCollections, at least one for each
+    collection. Records of directories are passed by name; archives are
+    read here, in one pass, and their records passed along with their
+    content, so that no task has to open the archive again.
+    """
+    number = itertools.count()
+    patterns = fileNamePattern.split()
+    for index, (recordSetPath, collectionName, _) in enumerate(evaluations):
+        if _recordSource(recordSetPath) != 'directory':
+            batches = (
+                (None, contents) for contents in _batches(_archiveContents(
+                    recordSetPath,
+                    lambda name: _isArchiveRecord(name, patterns)),
+                    recordsPerTask))
+        else:
+            batches = (
+                (records, None) for records in _batches(collectionRecords(
+                    recordSetPath, fileNamePattern), recordsPerTask))
+        # an empty collection still gets a task, and an empty store
+        first = next(batches, ([], None))
+        for records, contents in itertools.chain([first], batches):
+            part = os.path.join(partDirectory, '%06d.csv' % next(number))
+            yield (index, recordSetPath, collectionName, part, records,
+                   contents)
+
+
+def _orderedResults(executor, function, tasks, window):
+    """Like ``executor.map`` but only submits tasks ``window`` at a time
+    ahead of the results that have been consumed, so that tasks can be
+    generated lazily and finished results do not pile up.
+    """
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(executor.submit(function, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _partRows(parts, entries):
+    """Yield the rows of finished ``parts`` in order, collecting their
+    manifest entries in ``entries``.
+    """
+    for _, part, partEntries in parts:
+        entries.update(partEntries)
+        with open(part, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                yield tuple(row)
+        os.remove(part)
+
+
+def _evaluationStores(recordSetPaths, DataDirectory, codec, storeFormat):
+    """The ``(recordSetPath, collectionName, DataDestination)`` of each
+    collection evaluated into ``DataDirectory``. Raises a ValueError when
+    two collections, such as ``ColA.tar.gz`` and a directory ``ColA``,
+    would be evaluated into the same store.
+    """
+    evaluations = []
+    sources = {}
+    for recordSetPath in recordSetPaths:
+        recordSetPath = os.path.normpath(recordSetPath)
+        collectionName = _collectionName(recordSetPath)
+        DataDestination = evaluatedLocation(DataDirectory, collectionName,
+                                            codec, storeFormat)
+        if DataDestination in sources:
+            raise ValueError('%s and %s would both be evaluated to %s' % (
+                sources[DataDestination], recordSetPath, DataDestination))
+        sources[DataDestination] = recordSetPath
+        evaluations.append((recordSetPath, collectionName, DataDestination))
+    return evaluations
+
+
+def evaluateCollections(recordSetPaths, DataDirectory, workers=None,
+                        recordsPerTask=64, fileNamePattern='*.xml', codec=None,
+                        compressionLevel=None, storeFormat='csv'):
+    """Evaluate several collections, directories or zip or tar archives,
+    in parallel. The records of all collections are split into tasks of
+    ``recordsPerTask`` records and spread across a pool of ``workers``
+    processes (default: one per core). The part files of each collection
+    are merged, in record order, into ``<collection>_XpathEvaluated.csv``
+    in ``DataDirectory``, so the output is the same as evaluating each
+    collection with evaluateCollection.
+    With a ``codec`` the merged csv is compressed as it is written and
+    gets the suffix of the codec. ``storeFormat`` can be ``'parquet'`` or
+    ``'arrow'`` for a columnar store. Returns the list of evaluated files.
+    Collections whose stores would have the same name are refused with a
+    ValueError.
+    """
+    evaluations = _evaluationStores(recordSetPaths, DataDirectory, codec,
+                                    storeFormat)
+    os.makedirs(DataDirectory, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    partDirectory = tempfile.mkdtemp(prefix='.evaluating', dir=DataDirectory)
+
+    lggr.info('Evaluating %d collections' % len(evaluations))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            finished = _orderedResults(
+                executor, _evaluatePart,
+                _evaluationTasks(evaluations, partDirectory, recordsPerTask,
+                                 fileNamePattern),
+                2 * workers)
+            for index, parts in itertools.groupby(
+                    finished, key=lambda result: result[0]):
+                _, collectionName, DataDestination = evaluations[index]
+                entries = {}
+                _writeEvaluated(_partRows(parts, entries), DataDestination,
+                                codec, compressionLevel)
+                _writeManifest(DataDestination, collectionName, entries)
+    finally:
+        shutil.rmtree(partDirectory, ignore_errors=True)
+
+    return [DataDestination for _, _, DataDestination in evaluations]
+
+
+def _readEvaluatedRows(DataDestination):
+    """Yield the rows of an evaluated store written by _writeEvaluated."""
+    if _storeFormat(DataDestination) != 'csv':
+        for batch in _evaluatedBatches(DataDestination):
+            for row in zip(*(column.to_pylist() for column in batch.columns)):
+                yield row
+        return
+    with _openEvaluated(DataDestination, 'r') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            yield tuple(row)
+
+
+def _spliceRows(storedRows, records, evaluated):
+    """Rebuild the rows of a collection from ``storedRows``, in the order
+    of the store, whatever the order of ``records``. The rows of the
+    records in ``evaluated`` replace their stored rows, and stored rows of
+    records that are no longer in ``records`` are dropped. Evaluated
+    records that have no stored rows, new records among them, come last,
+    in the order of ``records``.
+    """
+    current = set(records)
+    spliced = set()
+    for record, rows in itertools.groupby(storedRows, key=lambda row: row[1]):
+        if record in evaluated:
+            if record not in spliced:
+                spliced.add(record)
+                for row in evaluated[record]:
+                    yield row
+        elif record in current:
+            for row in rows:
+                yield row
+    for record in records:
+        if record in evaluated and record not in spliced:
+            for row in evaluated[record]:
+                yield row
+
+
+def updateCollection(recordSetPath, DataDestination, collectionName=None,
+                     fileNamePattern='*.xml', compressionLevel=None):
+    """Bring the evaluated store of a collection up to date with its
+    records. Only records that are new or whose content changed since the
+    last run, according to the manifest next to ``DataDestination``, are
+    evaluated; the rows of deleted records are dropped and the rest are
+    copied from the existing store, in its order, new records being added
+    at the end. Without a manifest the whole collection is evaluated.
+    Returns ``True`` if the store changed.
+    """
+    recordSetPath = os.path.normpath(recordSetPath)
+    if collectionName is None:
+        collectionName = _collectionName(recordSetPath)
+    manifest = readManifest(DataDestination)
+    if manifest is None:
+        evaluateCollection(recordSetPath, DataDestination, collectionName,
+                           fileNamePattern, compressionLevel=compressionLevel)
+        return True
+
+    previous = manifest['Records']
+    records, signatures, contents = _recordSignatures(
+        recordSetPath, fileNamePattern, previous)
+    entries = {}
+    changed = []
+    for record in records:
+        entry = previous.get(record)
+        if record not in signatures:
+            entries[record] = entry
+            continue
+        signature = signatures[record]
+        if entry is not None and entry['sha256'] == signature['sha256']:
+            signature['rows'] = entry['rows']
+            entries[record] = signature
+            continue
+        changed.append(record)
+    deleted = set(previous) - set(records)
+
+    if not changed and not deleted:
+        if entries != previous:
+            _writeManifest(DataDestination, collectionName, entries)
+        return False
+
+    lggr.info('Updating %s: %d new or changed, %d deleted records' % (
+        collectionName, len(changed), len(deleted)))
+    evaluated = {record: [] for record in changed}
+    if contents is None:
+        rows = _evaluateRecords(recordSetPath, changed, collectionName,
+                                entries)
+    else:
+        rows = _evaluateContents(
+            ((record,) + contents.pop(record) for record in changed),
+            collectionName, entries)
+    for row in rows:
+        evaluated[row[1]].append(row)
+    spliced = os.path.join(os.path.dirname(DataDestination),
+                           '.' + os.path.basename(DataDestination))
+    _writeEvaluated(
+        _spliceRows(_readEvaluatedRows(DataDestination), records, evaluated),
+        spliced, _compressionCodec(DataDestination), compressionLevel)
+    os.replace(spliced, DataDestination)
+    _writeManifest(DataDestination, collectionName, entries)
+
+    return True
+
+
+def updateCollections(recordSetPaths, DataDirectory, workers=None,
+                      fileNamePattern='*.xml', codec=None,
+                      compressionLevel=None, storeFormat='csv'):
+    """Incrementally update the evaluated stores of several collections in
+    ``DataDirectory``. Collections that have not been evaluated yet are
+    evaluated in parallel with evaluateCollections, the others with
+    updateCollection. Returns the names of the collections whose store
+    changed, so that later stages only need to be rerun for those.
+    Collections whose stores would have the same name are refused with a
+    ValueError, as in evaluateCollections.
+    """
+    changed = []
+    unevaluated = []
+    for recordSetPath, collectionName, DataDestination in _evaluationStores(
+            recordSetPaths, DataDirectory, codec, storeFormat):
+        if readManifest(DataDestination) is None:
+            unevaluated.append(recordSetPath)
+            changed.append(collectionName)
+        elif updateCollection(recordSetPath, DataDestination, collectionName,
+                              fileNamePattern, compressionLevel):
+            changed.append(collectionName)
+    if unevaluated:
+        evaluateCollections(unevaluated, DataDirectory, workers,
+                            fileNamePattern=fileNamePattern, codec=codec,
+                            compressionLevel=compressionLevel,
+                            storeFormat=storeFormat)
+
+    return changed
+
+
+def harvestCollection(urls, recordNames, DataDestination, collectionName,
+                      archiveDirectory=None, workers=8, retries=3,
+                      backoff=0.5, timeout=60, validators=None, session=None,
+                      chunk_size=1 << 16, codec=None, compressionLevel=None):
+    """Download and evaluate a collection in one go. Each record is
+    parsed once, as it is downloaded, and the parse is evaluated straight
+    into the ``Collection,Record,XPath,Content`` rows written to
+    ``DataDestination``, so nothing has to be parsed again from disk.
+    Records are named ``recordNames`` and kept in the order of ``urls``.
+
+    Raw records are only written when an ``archiveDirectory`` is given.
+    Archived records are then only downloaded again if they changed, the
+    archived copy being evaluated otherwise, and the store gets a manifest
+    so the archive can later be updated with updateCollection. Downloads
+    are made as in get_records. Returns the outcome for each URL.
+    """
+    if len(urls) != len(recordNames):
+        raise ValueError('Different number of URLs and record names')
+
+    recordNames = [name if name[-4:] == '.xml' else name + '.xml'
+                   for name in recordNames]
+    DataDestinationDirectory = os.path.dirname(DataDestination)
+    if DataDestinationDirectory:
+        os.makedirs(DataDestinationDirectory, exist_ok=True)
+    fnames = [None] * len(urls)
+    if archiveDirectory is not None:
+        os.makedirs(archiveDirectory, exist_ok=True)
+        fnames = [os.path.join(archiveDirectory, name) for name in recordNames]
+    consumers = [
+        lambda chunks, recordName=recordName: evaluateEvents(
+            _pullEvents(chunks), collectionName, recordName)
+        for recordName in recordNames]
+    fetched = _fetchRecords(urls, fnames, consumers, workers, retries,
+                            backoff, timeout, validators, session, chunk_size)
+
+    entries = {}
+    outcomes = []
+    _writeEvaluated(_harvestedRows(fetched, recordNames, fnames,
+                                   collectionName, entries, outcomes),
+                    DataDestination, codec, compressionLevel)
+    if archiveDirectory is not None:
+        _writeManifest(DataDestination, collectionName, entries)
+    elif os.path.exists(manifestLocation(DataDestination)):
+        # the store no longer describes records on disk
+        os.remove(manifestLocation(DataDestination))
+
+    return outcomes
+
+
+def _harvestedRows(fetched, recordNames, fnames, collectionName, entries,
+                   outcomes):
+    """Yield the evaluation rows of the records fetched by
+    harvestCollection, one record at a time as they arrive. Records that
+    were not modified, or that could not be downloaded again, are
+    evaluated from their archived copy. The manifest entry of each
+    archived record is stored in ``entries`` and the outcome of each URL
+    appended to ``outcomes``.
+    """
+    for recordName, fname, (outcome, rows) in zip(recordNames, fnames,
+                                                  fetched):
+        outcomes.append(outcome)
+        archived = fname is not None and os.path.exists(fname)
+        if outcome in ('failed', 'not well-formed') and archived:
+            lggr.warning('Could not download %s again (%s), evaluating the '
+                         'archived copy' % (recordName, outcome))
+            rows = _tryEvaluateRecord(fname, collectionName, recordName)
+        elif outcome == 'not modified':
+            rows = _tryEvaluateRecord(fname, collectionName, recordName)
+        if rows is None:
+            continue
+        if fname is not None:
+            entries[recordName] = _recordSignature(fname)
+            entries[recordName]['rows'] = len(rows)
+        for row in rows:
+            yield row
+
+
+# XPath vocabulary
+def loadXpathVocabulary(location):
+    """Load the XPath vocabulary kept in the csv ``location``. The
+    vocabulary is an index of every XPath seen so far, the position of an
+    XPath being its ID. XPaths are only ever appended, so the IDs stay
+    the same across collections and runs. Returns an empty vocabulary if
+    there is none yet.
+    """
+    if not os.path.exists(location):
+        return pd.Index([], dtype=object, name='XPath')
+    xpaths = pd.read_csv(location, dtype=str, keep_default_na=False)['XPath']
+    return pd.Index(xpaths, dtype=object, name='XPath')
+
+
+def updateXpathVocabulary(vocabulary, xpaths):
+    """Add the XPaths of ``xpaths`` that are not in ``vocabulary`` yet, in
+    order of appearance. Returns the updated vocabulary.
+    """
+    new = pd.Index(pd.unique(pd.Series(xpaths, dtype=object)), dtype=object)
+    new = new[vocabulary.get_indexer(new) < 0]
+    if not len(new):
+        return vocabulary
+    return vocabulary.append(new).rename('XPath')
+
+
+def saveXpathVocabulary(vocabulary, location):
+    """Write ``vocabulary`` to the csv ``location``."""
+    vocabulary.to_frame(index=False).to_csv(location + '.tmp', index=False)
+    os.replace(location + '.tmp', location)
+
+
+def xpathCodes(xpaths, vocabulary):
+    """The int32 IDs of ``xpaths`` in ``vocabulary``. Each distinct XPath
+    is looked up once; XPaths that already are IDs are returned as is.
+    """
+    if pd.api.types.is_integer_dtype(xpaths):
+        return np.asarray(xpaths, dtype='int32')
+    xpaths = pd.Categorical(xpaths).remove_unused_categories()
+    ids = vocabulary.get_indexer(xpaths.categories)
+    if (ids < 0).any():
+        raise KeyError('%d XPaths are not in the vocabulary, update it first'
+                       % (ids < 0).sum())
+    return ids.astype('int32').take(xpaths.codes)
+
+
+def encodeXpaths(EvaluatedMetadataDF, vocabulary):
+    """Replace the XPath column of an evaluated metadata dataframe by the
+    int32 IDs of the XPaths in ``vocabulary``. The analysis functions
+    group and match on the IDs and only turn them back into XPaths for
+    their reports.
+    """
+    return EvaluatedMetadataDF.assign(
+        XPath=xpathCodes(EvaluatedMetadataDF['XPath'], vocabulary))
+
+
+def decodeXpaths(codes, vocabulary):
+    """The XPaths of the IDs ``codes``."""
+    return vocabulary.take(np.asarray(codes, dtype='int64'))
 
 
 def recordXpathContent(EvaluatedMetadataDF):
@@ -90,7 +1414,7 @@ def recordXpathContent(EvaluatedMetadataDF):
     EvaluatedMetadataDF = EvaluatedMetadataDF.applymap(str)
 
     group_name = EvaluatedMetadataDF.groupby([
-        'Collection', 'Record', 'XPath'], as_index=False)
+        'Collection', 'Record', 'XPath'], observed=True)
     occurrenceMatrix = group_name['Content'].apply(
         lambda x: '%s' % ', '.join(x)).unstack().reset_index()
 
@@ -102,79 +1426,419 @@ def recordXpathContent(EvaluatedMetadataDF):
 
     return(occurrenceMatrix)
 
-def applyRecommendation(recElements, recommendationName, collection):
+_writes = collections.deque()
+_writer = None
 
-    # places for all the evaluated and analyzed data
-    XpathEvaluated = os.path.join("..","data", recommendationName, collection + "_XpathEvaluated.csv.gz")
-    EvaluatedDF = pd.read_csv(XpathEvaluated)
 
-    # Use above dataframe and apply the xpathCounts and xpathOccurrence functions from MDeval for each recommendation
+def _writeLater(function, *args, **kwargs):
+    """Persist an analysis in the background: call ``function`` on a
+    writer thread. waitForWrites waits for it.
+    """
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=2)
+    _writes.append(_writer.submit(function, *args, **kwargs))
 
 
-    
-    RecommendationEvaluated = os.path.join("..","data", recommendationName, collection + '_' + recommendationName + 'Evaluated.csv.gz')
-    #RecommendationCounts = os.path.join("../data/", collection + '_' + recommendationName + 'Counts.csv')
-    RecommendationOccurrence = os.path.join("..","data", recommendationName, collection + '_' + recommendationName + 'Occurrence.csv')
-    
-   
-    # Use the output of the evaluation transform and the piped string 
-    # of all root paths to create a dataframe of just recommendation elements
-    recElementsPattern = '|'.join(recElements)
-    
-    RecommendationDF = EvaluatedDF[EvaluatedDF['XPath'].str.contains(recElementsPattern)]
-    
-    RecommendationDF.to_csv(RecommendationEvaluated, index=False, compression='gzip')
-                
-    
-    #XpathCounts(RecommendationDF, RecommendationCounts)
-    
-      # change order of rows to be meaningful for recommendation
-    #RecommendationCountsDF = pd.read_csv(RecommendationCounts)
-    CollectionRecRows = []
-    CollectionRecRows.append(["Number of Records"])
-
-    CollectionRecColumns = []
-    CollectionRecColumns.append(["Collection","Record"])
-    XpathOccurrence(RecommendationDF, collection, RecommendationOccurrence)
-    
-    RecommendationOccurrenceDF = pd.read_csv(RecommendationOccurrence)
-    for element in recElements:
+def waitForWrites():
+    """Wait until the analyses persisted in the background are written,
+    raising the error of any that failed.
+    """
+    while _writes:
+        _writes.popleft().result()
 
-        # find the rows that match each element
-        CollectionElements = list(RecommendationOccurrenceDF['XPath'])[1:]
 
-        matchingElements = [CollectionElement for CollectionElement in CollectionElements if element in CollectionElement]
+class RecommendationMatcher(object):
+    """Aho-Corasick automaton over the elements of a recommendation. It
+    finds every element contained in an XPath in a single pass over the
+    XPath, however many elements there are. Elements match as substrings,
+    like ``element in xpath``.
+    """
 
-        #append the list to a master list that will be used to order the chart
-        CollectionRecRows.append(matchingElements)
-        CollectionRecColumns.append(matchingElements)
+    def __init__(self, recElements):
+        self.elements = list(recElements)
+        goto = [{}]
+        output = [[]]
+        for index, element in enumerate(self.elements):
+            state = 0
+            for char in element:
+                if char not in goto[state]:
+                    goto[state][char] = len(goto)
+                    goto.append({})
+                    output.append([])
+                state = goto[state][char]
+            output[state].append(index)
+
+        # failure links, breadth first so shorter suffixes are done first
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in goto[state].items():
+                queue.append(child)
+                suffix = fail[state]
+                while suffix and char not in goto[suffix]:
+                    suffix = fail[suffix]
+                fail[child] = goto[suffix].get(char, 0)
+                output[child] = output[child] + output[fail[child]]
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def match(self, xpath):
+        """Indexes of the elements contained in ``xpath``."""
+        return set(self.matchEnds(xpath))
+
+    def matchEnds(self, xpath):
+        """Indexes of the elements contained in ``xpath``, with the
+        position in ``xpath`` where their last occurrence ends.
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        found = dict.fromkeys(output[0], 0)
+        for end, char in enumerate(xpath, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                found[index] = end
+        return found
+
+    def matchAll(self, xpaths):
+        """Boolean array with a row for each of ``xpaths`` and a column for
+        each element, true where the XPath contains the element.
+        """
+        matched = np.zeros((len(xpaths), len(self.elements)), dtype=bool)
+        for row, xpath in enumerate(xpaths):
+            matched[row, list(self.match(xpath))] = True
+        return matched
+
+
+def _recommendationOrder(matcher, xpaths, elements=None):
+    """Order ``xpaths`` for a recommendation report: the XPaths containing
+    the first element of ``matcher``, then those containing the second,
+    and so on, each XPath once. XPaths without an element are left out.
+    ``elements`` limits the order to a range of the matcher's elements.
+    """
+    if elements is None:
+        elements = range(len(matcher.elements))
+    byElement = collections.OrderedDict((index, []) for index in elements)
+    for xpath in xpaths:
+        for index in matcher.match(xpath):
+            if index in byElement:
+                byElement[index].append(xpath)
+    return list(collections.OrderedDict.fromkeys(
+        itertools.chain.from_iterable(byElement.values())))
+
+
+def recommendationOccurrences(EvaluatedDF, recommendations, collection,
+                              vocabulary=None):
+    """Apply several recommendations to the evaluated metadata of a
+    collection in memory. ``recommendations`` maps recommendation names to
+    their elements. The elements of all recommendations are compiled into
+    one RecommendationMatcher, so each distinct XPath is matched once for
+    all of them and rows are selected by their XPath; the occurrence of
+    every recommendation comes from a single grouping of the rows.
+    Returns, for each recommendation, the evaluated metadata of its
+    elements and their occurrence, with rows ordered by recommendation
+    element. With an XPath ``vocabulary`` both are on XPath IDs.
+    """
+    names, bounds, matcher = _combinedMatcher(recommendations)
+    if vocabulary is not None:
+        EvaluatedDF = encodeXpaths(EvaluatedDF, vocabulary)
+    positions, values = pd.factorize(EvaluatedDF['XPath'])
+    values = pd.Index(values)
+    matched = matcher.matchAll(
+        decodeXpaths(values, vocabulary) if vocabulary is not None else values)
+
+    # the occurrence of the rows of any recommendation, grouped once
+    RecommendedDF = EvaluatedDF[matched.any(axis=1)[positions]]
+    sizes = RecommendedDF.groupby(['Record', 'XPath'], sort=False,
+                                  observed=True).size()
+    sizePositions = values.get_indexer(sizes.index.get_level_values('XPath'))
+
+    results = collections.OrderedDict()
+    for number, name in enumerate(names):
+        recElements = range(bounds[number], bounds[number + 1])
+        recommended = matched[:, recElements].any(axis=1)
+        RecommendationDF = EvaluatedDF[recommended[positions]]
+        RecommendationOccurrenceDF = _recommendationRows(
+            _occurrenceFromSizes(sizes[recommended[sizePositions]],
+                                 collection, vocabulary),
+            matcher, recElements)
+        results[name] = (RecommendationDF, RecommendationOccurrenceDF)
+
+    return results
+
+
+def _combinedMatcher(recommendations):
+    """The names of ``recommendations``, the bounds of the elements of each
+    in the combined list of elements, and a RecommendationMatcher over
+    that list.
+    """
+    names = list(recommendations)
+    elements = [list(recommendations[name]) for name in names]
+    bounds = np.cumsum([0] + [len(recElements) for recElements in elements])
+    matcher = RecommendationMatcher(itertools.chain.from_iterable(elements))
+    return names, bounds, matcher
 
-    CollectionRecRows = [item for sublist in CollectionRecRows for item in sublist]
-    CollectionRecColumns = [item for sublist in CollectionRecColumns for item in sublist]
-    from collections import OrderedDict
-    CollectionRecRows = list(OrderedDict.fromkeys(CollectionRecRows))
-    CollectionRecColumns = list(OrderedDict.fromkeys(CollectionRecColumns))
-   
-    #RecommendationCountsDF = RecommendationCountsDF[CollectionRecColumns]
 
-    # write over the previous csv
-    #RecommendationCountsDF.to_csv(RecommendationCounts, index=False, mode='w')
-    
- 
+def _recommendationRows(RecommendationOccurrenceDF, matcher, recElements):
+    """Order the rows of a recommendation's occurrence by the
+    ``recElements`` of ``matcher``.
+    """
     # change order of rows to be meaningful for recommendation
+    CollectionRecRows = ["Number of Records"] + _recommendationOrder(
+        matcher, list(RecommendationOccurrenceDF['XPath'])[1:], recElements)
     RecommendationOccurrenceDF = RecommendationOccurrenceDF.set_index('XPath')
-
     RecommendationOccurrenceDF = RecommendationOccurrenceDF.loc[CollectionRecRows]
-    RecommendationOccurrenceDF = RecommendationOccurrenceDF.reset_index()
+    return RecommendationOccurrenceDF.reset_index()
+
+
+def _chunkedRecommendations(XpathEvaluated, recommendations, collection,
+                            memoryBudget, vocabulary=None, to_csv=True):
+    """recommendationOccurrences on an evaluated store read in chunks of
+    whole records within ``memoryBudget`` bytes. The evaluated metadata
+    of each recommendation is written chunk by chunk, when ``to_csv``, to
+    its data directory, and its location returned in place of the
+    dataframe.
+    """
+    names, bounds, matcher = _combinedMatcher(recommendations)
+    matchedXpaths = {}
+    sums = {name: _occurrenceSums() for name in names}
+    outputs = {}
+    try:
+        if to_csv:
+            for name in names:
+                RecommendationEvaluated = _recommendationLocations(
+                    name, collection)[0]
+                os.makedirs(os.path.dirname(RecommendationEvaluated),
+                            exist_ok=True)
+                outputs[name] = (RecommendationEvaluated, gzip.open(
+                    RecommendationEvaluated, 'wt', encoding='utf-8',
+                    newline=''))
+        for chunk in _recordChunks(readEvaluatedChunks(
+                XpathEvaluated, None, memoryBudget)):
+            if vocabulary is not None:
+                chunk = encodeXpaths(chunk, vocabulary)
+            positions, values = pd.factorize(chunk['XPath'])
+            new = [value for value in values if value not in matchedXpaths]
+            if new:
+                newMatches = matcher.matchAll(
+                    decodeXpaths(new, vocabulary) if vocabulary is not None
+                    else new)
+                matchedXpaths.update(zip(new, newMatches))
+            matched = np.array([matchedXpaths[value] for value in values])
+
+            RecommendedDF = chunk[matched.any(axis=1)[positions]]
+            sizes = RecommendedDF.groupby(['Record', 'XPath'], sort=False,
+                                          observed=True).size()
+            sizePositions = pd.Index(values).get_indexer(
+                sizes.index.get_level_values('XPath'))
+            for number, name in enumerate(names):
+                recommended = matched[:, bounds[number]:bounds[number + 1]].any(axis=1)
+                _addOccurrence(sums[name], sizes[recommended[sizePositions]])
+                if to_csv:
+                    RecommendationDF = chunk[recommended[positions]]
+                    if vocabulary is not None:
+                        RecommendationDF = RecommendationDF.assign(XPath=decodeXpaths(
+                            RecommendationDF['XPath'], vocabulary))
+                    f = outputs[name][1]
+                    RecommendationDF.to_csv(f, header=f.tell() == 0,
+                                            index=False)
+    finally:
+        for _, f in outputs.values():
+            f.close()
+
+    results = collections.OrderedDict()
+    for number, name in enumerate(names):
+        RecommendationOccurrenceDF = _recommendationRows(
+            _occurrenceTable(sums[name], collection, vocabulary), matcher,
+            range(bounds[number], bounds[number + 1]))
+        results[name] = (outputs[name][0] if to_csv else None,
+                         RecommendationOccurrenceDF)
+    return results
+
+
+def recommendationOccurrence(EvaluatedDF, recElements, collection,
+                             vocabulary=None):
+    """Apply a recommendation to the evaluated metadata of a collection in
+    memory, see recommendationOccurrences. Returns the evaluated metadata
+    of the recommendation elements and their occurrence.
+    """
+    return recommendationOccurrences(
+        EvaluatedDF, {None: recElements}, collection, vocabulary)[None]
+
+
+def _writeRecommendationEvaluated(RecommendationDF, DataDestination,
+                                  vocabulary=None):
+    if vocabulary is not None:
+        RecommendationDF = RecommendationDF.assign(
+            XPath=decodeXpaths(RecommendationDF['XPath'], vocabulary))
+    RecommendationDF.to_csv(DataDestination, index=False, compression='gzip')
+
+
+def _recommendationLocations(recommendationName, collection):
+    """Where the evaluated metadata and the occurrence of a recommendation
+    are kept.
+    """
+    RecommendationEvaluated = os.path.join("..","data", recommendationName, collection + '_' + recommendationName + 'Evaluated.csv.gz')
+    RecommendationOccurrence = os.path.join("..","data", recommendationName, collection + '_' + recommendationName + 'Occurrence.csv')
+    return RecommendationEvaluated, RecommendationOccurrence
+
+
+def _writeRecommendation(RecommendationDF, RecommendationOccurrenceDF,
+                         recommendationName, collection, vocabulary=None):
+    """Write the results of a recommendation in the background. The
+    evaluated metadata is not written when RecommendationDF is None.
+    """
+    RecommendationEvaluated, RecommendationOccurrence = _recommendationLocations(
+        recommendationName, collection)
+    os.makedirs(os.path.join("..","data", recommendationName), exist_ok=True)
+    if RecommendationDF is not None:
+        _writeLater(_writeRecommendationEvaluated, RecommendationDF,
+                    RecommendationEvaluated, vocabulary)
+    lggr.info('Saving XPath occurrence report to %s' % RecommendationOccurrence)
+    _writeLater(RecommendationOccurrenceDF.to_csv, RecommendationOccurrence,
+                mode='w', index=False)
+
+
+def applyRecommendations(recommendations, collection, vocabulary=None,
+                         EvaluatedDF=None, to_csv=True, XpathEvaluated=None,
+                         memoryBudget=None):
+    """Apply several recommendations to a collection in one pass with
+    recommendationOccurrences. ``recommendations`` maps recommendation
+    names to their elements. The evaluated metadata is read once, from
+    ``XpathEvaluated`` or else the data directory of the first
+    recommendation, unless ``EvaluatedDF`` is given. With ``to_csv`` the
+    results of each recommendation are written in the background to its
+    data directory, as by applyRecommendation. Returns the results of each
+    recommendation.
+
+    With a ``memoryBudget``, in bytes, a collection too big for memory is
+    read in chunks of whole records within the budget instead. The
+    evaluated metadata of each recommendation is then written as it is
+    selected, and its location is returned instead of a dataframe.
+    """
+    if EvaluatedDF is None and XpathEvaluated is None:
+        XpathEvaluated = findEvaluated(
+            os.path.join("..", "data", next(iter(recommendations))),
+            collection)
+    if EvaluatedDF is None and memoryBudget is not None:
+        results = _chunkedRecommendations(XpathEvaluated, recommendations,
+                                          collection, memoryBudget,
+                                          vocabulary, to_csv)
+        if to_csv:
+            for recommendationName, (_, RecommendationOccurrenceDF) in results.items():
+                _writeRecommendation(None, RecommendationOccurrenceDF,
+                                     recommendationName, collection)
+        return results
+    if EvaluatedDF is None:
+        EvaluatedDF = readEvaluated(XpathEvaluated)
+
+    results = recommendationOccurrences(EvaluatedDF, recommendations,
+                                        collection, vocabulary)
+    if to_csv:
+        for recommendationName, (RecommendationDF,
+                                 RecommendationOccurrenceDF) in results.items():
+            _writeRecommendation(RecommendationDF, RecommendationOccurrenceDF,
+                                 recommendationName, collection, vocabulary)
+
+    return results
+
+
+def applyRecommendation(recElements, recommendationName, collection,
+                        vocabulary=None, EvaluatedDF=None, to_csv=True,
+                        memoryBudget=None):
+    """Apply a recommendation to the evaluated metadata of a collection
+    with recommendationOccurrence, reading the evaluated metadata unless
+    ``EvaluatedDF`` is given. With ``to_csv`` the recommendation's
+    evaluated metadata and occurrence are written in the background to the
+    recommendation's data directory; call waitForWrites to wait for them.
+    Returns both as dataframes. With a ``memoryBudget`` the collection is
+    read in chunks, see applyRecommendations.
+    """
+    return applyRecommendations({recommendationName: recElements}, collection,
+                                vocabulary, EvaluatedDF, to_csv,
+                                memoryBudget=memoryBudget)[recommendationName]
+
+
+def _chunkedCounts(XpathEvaluated, DataDestination, memoryBudget,
+                   vocabulary=None):
+    """Write the XpathCounts csv of an evaluated store read in chunks of
+    whole records within ``memoryBudget`` bytes, in two passes: the first
+    finds the XPaths, the second writes the counts of the records a block
+    at a time. Records are written in the order of the store.
+    """
+    XPathCount, RecordCount, NumberOfRecords = _chunkedOccurrence(
+        XpathEvaluated, memoryBudget, vocabulary)
+    xpaths = XPathCount.index.to_numpy()
+    labels = (decodeXpaths(xpaths, vocabulary) if vocabulary is not None
+              else pd.Index(xpaths))
+    order = np.argsort(np.asarray(labels, dtype=object), kind='stable')
+    xpaths = xpaths[order]
+    labels = list(labels[order])
+    # like the unstacked counts, every count is float once an XPath is
+    # missing from a record
+    missing = (RecordCount.reindex(xpaths) < NumberOfRecords).to_numpy()
+    countType = float if missing.any() else int
+    recordsPerBlock = max(
+        1, int(memoryBudget / (8 * max(len(labels), 1) * CHUNK_OVERHEAD)))
+
+    lggr.info('Saving Xpath counts report to %s' % DataDestination)
+    header = True
+    with open(DataDestination, 'w', newline='') as f:
+        for chunk in _recordChunks(readEvaluatedChunks(
+                XpathEvaluated, ['Collection', 'Record', 'XPath'],
+                memoryBudget)):
+            if vocabulary is not None:
+                chunk = encodeXpaths(chunk, vocabulary)
+            sizes = chunk.groupby(['Collection', 'Record', 'XPath'],
+                                  observed=True).size()
+            recordNumbers = pd.factorize(sizes.index.droplevel('XPath'))[0]
+            bounds = np.searchsorted(
+                recordNumbers, np.arange(0, recordNumbers[-1] + 1 + recordsPerBlock,
+                                         recordsPerBlock))
+            for low, high in zip(bounds[:-1], bounds[1:]):
+                if low == high:
+                    continue
+                block = sizes.iloc[low:high].unstack().reindex(
+                    columns=xpaths, fill_value=0)
+                block = block.fillna(0).astype(countType)
+                block.columns = labels
+                block.reset_index().to_csv(f, header=header, index=False)
+                header = False
+        if header:
+            pd.DataFrame(columns=['Collection', 'Record'] + labels).to_csv(
+                f, index=False)
+
 
 def XpathCounts(EvaluatedMetadataDF,
-                DataDestination, to_csv=True):
+                DataDestination, to_csv=True, vocabulary=None,
+                memoryBudget=DEFAULT_MEMORY_BUDGET):
     """XpathCounts requires a dataframe with xpath.The DF
     can created be localAllNodesEval, XMLeval(not accurate), or
-    a simpleXpath. It is required for combineXpathCounts"""
+    a simpleXpath. It is required for combineXpathCounts.
+    With an XPath ``vocabulary`` the counts are made on XPath IDs.
+    EvaluatedMetadataDF can also be the location of an evaluated store,
+    too big for memory, which is then read in chunks of whole records
+    within ``memoryBudget`` bytes and written straight to
+    ``DataDestination``; nothing is returned then."""
+    if isinstance(EvaluatedMetadataDF, str):
+        _chunkedCounts(EvaluatedMetadataDF, DataDestination, memoryBudget,
+                       vocabulary)
+        return None
+    if vocabulary is not None:
+        EvaluatedMetadataDF = encodeXpaths(EvaluatedMetadataDF, vocabulary)
     group_name = EvaluatedMetadataDF.groupby(
-        ['Collection', 'Record', 'XPath'], as_index=False)
-    XpathCountsDF = group_name.size().unstack().reset_index()
+        ['Collection', 'Record', 'XPath'], observed=True)
+    XpathCountsDF = group_name.size().unstack()
+    if vocabulary is not None:
+        XpathCountsDF.columns = decodeXpaths(XpathCountsDF.columns, vocabulary)
+        XpathCountsDF = XpathCountsDF[sorted(XpathCountsDF.columns)]
+    XpathCountsDF = XpathCountsDF.reset_index()
     XpathCountsDF = XpathCountsDF.fillna(0)
     pd.options.display.float_format = '{:,.0f}'.format
 
@@ -185,80 +1849,374 @@ def XpathCounts(EvaluatedMetadataDF,
     return XpathCountsDF
 
 
+SparseXpathCounts = collections.namedtuple(
+    'SparseXpathCounts', ['Counts', 'Records', 'XPaths'])
+SparseXpathCounts.__doc__ = """XPath counts of a collection. ``Counts`` is
+a scipy CSR matrix with a row for each of ``Records`` (an index of
+Collection and Record) and a column for each of ``XPaths``.
+"""
+
+
+def _requireScipy():
+    if sparse is None:
+        raise ImportError('Sparse XPath counts require the scipy package')
+
+
+def XpathCountsSparse(EvaluatedMetadataDF, vocabulary=None):
+    """Sparse version of XpathCounts: the number of times each XPath
+    occurs in each record, as a SparseXpathCounts whose matrix only holds
+    the XPaths that occur in a record. With an XPath ``vocabulary`` the
+    counts are made on XPath IDs.
+    """
+    _requireScipy()
+    if vocabulary is not None:
+        EvaluatedMetadataDF = encodeXpaths(EvaluatedMetadataDF, vocabulary)
+    sizes = EvaluatedMetadataDF.groupby(
+        ['Collection', 'Record', 'XPath'], observed=True).size()
+    recordKeys = sizes.index.droplevel('XPath')
+    Records = recordKeys.unique()
+    rows = Records.get_indexer(recordKeys)
+    columns, XPaths = pd.factorize(sizes.index.get_level_values('XPath'),
+                                   sort=True)
+    Counts = sparse.csr_matrix(
+        (sizes.to_numpy(dtype='int32'), (rows, columns)),
+        shape=(len(Records), len(XPaths)))
+    XPaths = pd.Index(XPaths, name='XPath')
+    if vocabulary is not None:
+        XPaths = decodeXpaths(XPaths, vocabulary)
+        order = np.argsort(XPaths.to_numpy(dtype=object), kind='stable')
+        Counts = Counts[:, order]
+        XPaths = XPaths[order]
+    return SparseXpathCounts(Counts, Records, XPaths)
+
+
+def saveXpathCounts(counts, DataDestination):
+    """Save SparseXpathCounts to the npz file ``DataDestination``, without
+    densifying them.
+    """
+    Counts = counts.Counts.tocsr()
+    np.savez_compressed(
+        DataDestination, data=Counts.data, indices=Counts.indices,
+        indptr=Counts.indptr, shape=np.array(Counts.shape),
+        collections=np.array(counts.Records.get_level_values('Collection'),
+                             dtype=str),
+        records=np.array(counts.Records.get_level_values('Record'), dtype=str),
+        xpaths=np.array(counts.XPaths, dtype=str))
+
+
+def loadXpathCounts(location):
+    """Load SparseXpathCounts saved by saveXpathCounts."""
+    _requireScipy()
+    with np.load(location, allow_pickle=False) as f:
+        Counts = sparse.csr_matrix(
+            (f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        Records = pd.MultiIndex.from_arrays(
+            [f['collections'].astype(object), f['records'].astype(object)],
+            names=['Collection', 'Record'])
+        XPaths = pd.Index(f['xpaths'].astype(object), name='XPath')
+    return SparseXpathCounts(Counts, Records, XPaths)
+
+
+def XpathCountsToCsv(counts, DataDestination, maxCells=10 ** 7):
+    """Write SparseXpathCounts as the dense csv of XpathCounts. Meant for
+    small collections: raises ValueError rather than densify more than
+    ``maxCells`` records times XPaths.
+    """
+    cells = counts.Counts.shape[0] * counts.Counts.shape[1]
+    if cells > maxCells:
+        raise ValueError(
+            'Densifying %d records by %d XPaths exceeds %d cells'
+            % (counts.Counts.shape + (maxCells,)))
+    XpathCountsDF = pd.DataFrame(
+        counts.Counts.toarray(), index=counts.Records,
+        columns=list(counts.XPaths))
+    # like the unstacked counts, every count is float once an XPath is
+    # missing from a record
+    missing = counts.Counts.getnnz(axis=0) < counts.Counts.shape[0]
+    XpathCountsDF = XpathCountsDF.astype(
+        float if missing.any() else int).reset_index()
+    lggr.info('Saving Xpath counts report to %s' % DataDestination)
+    XpathCountsDF.to_csv(DataDestination, mode='w', index=False)
+    return XpathCountsDF
+
+
+def _xpathColumns(counts, xpaths):
+    """Columns of ``xpaths`` in SparseXpathCounts, all when None."""
+    if xpaths is None:
+        return np.arange(len(counts.XPaths))
+    columns = counts.XPaths.get_indexer(xpaths)
+    return columns[columns >= 0]
+
+
+def recordCompleteness(counts, xpaths=None):
+    """Fraction of ``xpaths`` (default all XPaths of the collection) that
+    occur in each record, computed on SparseXpathCounts. XPaths that occur
+    in no record count as missing.
+    """
+    present = counts.Counts[:, _xpathColumns(counts, xpaths)] > 0
+    total = len(counts.XPaths) if xpaths is None else len(xpaths)
+    return pd.Series(np.asarray(present.sum(axis=1)).ravel() / total,
+                     index=counts.Records, name='Completeness')
+
+
+def xpathCooccurrence(counts, xpaths=None):
+    """Number of records in which each pair of ``xpaths`` (default all
+    XPaths of the collection) occur together, computed on
+    SparseXpathCounts. The diagonal is the number of records of each XPath.
+    """
+    columns = _xpathColumns(counts, xpaths)
+    present = (counts.Counts[:, columns] > 0).astype('int32')
+    cooccurrence = (present.T @ present).toarray()
+    labels = counts.XPaths[columns]
+    return pd.DataFrame(cooccurrence, index=labels, columns=labels)
+
+
+# columns of the XpathOccurrence table and their types; the metrics are
+# kept numeric and only rounded for display
+OCCURRENCE_DTYPES = collections.OrderedDict([
+    ('XPath', str),
+    ('Collection', str),
+    ('XPathCount', 'int64'),
+    ('RecordCount', 'int64'),
+    ('AverageOccurrencePerRecord', 'float64'),
+    ('CollectionOccurrence%', 'float64'),
+])
+
+
+def readXpathOccurrence(location, columns=None):
+    """Load an XpathOccurrence csv with the types of OCCURRENCE_DTYPES,
+    without inferring them. ``columns`` restricts the columns that are
+    read.
+    """
+    if columns is None:
+        columns = list(OCCURRENCE_DTYPES)
+    return pd.read_csv(location, usecols=columns, na_filter=False,
+                       dtype={column: OCCURRENCE_DTYPES[column]
+                              for column in columns})[columns]
+
+
+def _occurrenceSums():
+    """Empty sums of occurrence: XPathCount and RecordCount of each XPath,
+    and the number of records.
+    """
+    empty = pd.Series([], dtype='int64', index=pd.Index([], name='XPath'))
+    return [empty, empty, 0]
+
+
+def _addOccurrence(sums, sizes):
+    """Add the occurrence of whole records to ``sums``. ``sizes`` is the
+    number of times each XPath occurs in each record: a Series indexed by
+    Record and XPath holding only the pairs that occur.
+    """
+    byXpath = sizes.groupby(level='XPath', sort=False, observed=True)
+    sums[0] = sums[0].add(byXpath.sum(), fill_value=0)
+    sums[1] = sums[1].add(byXpath.size(), fill_value=0)
+    sums[2] += sizes.index.get_level_values('Record').nunique()
+    return sums
+
+
+def _occurrenceTable(sums, Collection, vocabulary=None):
+    """Build the XpathOccurrence table from occurrence ``sums``. XPath IDs
+    are decoded with ``vocabulary``.
+    """
+    XPathCount, RecordCount, NumberOfRecords = sums
+    XPathCount = XPathCount.sort_index().astype('int64')
+    RecordCount = RecordCount.reindex(XPathCount.index).astype('int64')
+    xpaths = XPathCount.index
+    if vocabulary is not None:
+        xpaths = decodeXpaths(xpaths, vocabulary)
+    order = np.argsort(np.asarray(xpaths, dtype=object), kind='stable')
+
+    # the first row holds the number of records in every metric
+    XPathCount = np.concatenate([[NumberOfRecords], XPathCount.to_numpy()[order]])
+    RecordCount = np.concatenate([[NumberOfRecords], RecordCount.to_numpy()[order]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        AverageOccurrence = XPathCount / NumberOfRecords
+        CollectionOccurrence = RecordCount / NumberOfRecords
+    AverageOccurrence[0] = CollectionOccurrence[0] = NumberOfRecords
+    result = pd.DataFrame({
+        'XPath': ['Number of Records'] + list(np.asarray(xpaths, dtype=object)[order]),
+        'Collection': Collection,
+        'XPathCount': XPathCount,
+        'RecordCount': RecordCount,
+        'AverageOccurrencePerRecord': AverageOccurrence,
+        'CollectionOccurrence%': CollectionOccurrence,
+    })
+    return result.astype(OCCURRENCE_DTYPES)
+
+
+def _occurrenceFromSizes(sizes, Collection, vocabulary=None):
+    """Build the XpathOccurrence table from ``sizes``, the number of times
+    each XPath occurs in each record: a Series indexed by Record and XPath
+    holding only the pairs that occur. Memory scales with the number of
+    those pairs, never with records times XPaths. XPath IDs are decoded
+    with ``vocabulary``.
+    """
+    return _occurrenceTable(_addOccurrence(_occurrenceSums(), sizes),
+                            Collection, vocabulary)
+
+
+def _chunkedOccurrence(XpathEvaluated, memoryBudget, vocabulary=None):
+    """Occurrence sums of an evaluated store read in chunks of whole
+    records within ``memoryBudget`` bytes.
+    """
+    sums = _occurrenceSums()
+    for chunk in _recordChunks(readEvaluatedChunks(
+            XpathEvaluated, ['Record', 'XPath'], memoryBudget)):
+        if vocabulary is not None:
+            chunk = encodeXpaths(chunk, vocabulary)
+        _addOccurrence(sums, chunk.groupby(['Record', 'XPath'], sort=False,
+                                           observed=True).size())
+    return sums
+
+
 def XpathOccurrence(EvaluatedMetadataDF, Collection,
-                    DataDestination, to_csv=True):
+                    DataDestination, to_csv=True, vocabulary=None,
+                    memoryBudget=DEFAULT_MEMORY_BUDGET):
     # xpath occurrence data product
     """requires a list of xpathOccurrence csv.
-    It is required for CombinationSpreadsheet
+    It is required for CombinationSpreadsheet.
+    The occurrence is computed from the number of times each XPath occurs
+    in each record, without building a records by XPaths matrix.
+    With an XPath ``vocabulary`` the occurrence is computed on XPath IDs.
+    EvaluatedMetadataDF can also be the location of an evaluated store,
+    too big for memory, which is then read in chunks of whole records
+    within ``memoryBudget`` bytes.
     """
-    DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
-    os.makedirs(DataDestinationDirectory, exist_ok=True)
-    group_name = EvaluatedMetadataDF.groupby(
-        ['Record', 'XPath'], as_index=False)
-    occurrenceMatrix = group_name.size().unstack().reset_index()
-    occurrenceMatrix = occurrenceMatrix.fillna(0)
-    occurrenceSum = occurrenceMatrix.sum()
-    occurrenceCount = occurrenceMatrix[occurrenceMatrix != 0].count()
-
-    result = pd.concat([occurrenceSum, occurrenceCount], axis=1).reset_index()
-    result.insert(
-        1, 'Collection', Collection)
-    result.insert(4, 'CollectionOccurrence%', Collection)
-    result.insert(4, 'AverageOccurrencePerRecord', Collection)
-    result.columns = [
-        'XPath', 'Collection', 'XPathCount', 'RecordCount',
-        'AverageOccurrencePerRecord', 'CollectionOccurrence%'
-    ]
-    NumberOfRecords = result.at[0, 'XPathCount'].count('.xml')
-    result['CollectionOccurrence%'] = result['RecordCount'] / NumberOfRecords
-    result.at[0, 'XPathCount'] = NumberOfRecords
-    result.at[0, 'XPath'] = 'Number of Records'
-    result.at[0, 'CollectionOccurrence%'] = NumberOfRecords
-    result['AverageOccurrencePerRecord'] = (
-        result['XPathCount'] / NumberOfRecords)
-    result[['AverageOccurrencePerRecord', 'CollectionOccurrence%']] = (
-        result[['AverageOccurrencePerRecord',
-                'CollectionOccurrence%']].astype(float)
-    )
-    result[["XPathCount", "RecordCount"]] = (
-        result[["XPathCount", "RecordCount"]].astype(int)
-    )
-    result['AverageOccurrencePerRecord'] = (pd.Series([
-        "{0:.2f}".format(val) for val in result['AverageOccurrencePerRecord']
-    ], index=result.index))
-    result.at[0, 'AverageOccurrencePerRecord'] = NumberOfRecords
+    if isinstance(EvaluatedMetadataDF, str):
+        result = _occurrenceTable(
+            _chunkedOccurrence(EvaluatedMetadataDF, memoryBudget, vocabulary),
+            Collection, vocabulary)
+    else:
+        if vocabulary is not None:
+            EvaluatedMetadataDF = encodeXpaths(EvaluatedMetadataDF, vocabulary)
+        sizes = EvaluatedMetadataDF.groupby(['Record', 'XPath'], sort=False,
+                                            observed=True).size()
+        result = _occurrenceFromSizes(sizes, Collection, vocabulary)
 
     if to_csv:
+        DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
+        os.makedirs(DataDestinationDirectory, exist_ok=True)
         lggr.info('Saving XPath occurrence report to %s' % DataDestination)
         result.to_csv(DataDestination, mode='w', index=False)
 
     return result
 
 
+def _combinedRows(xpaths):
+    """Rows of a combined occurrence table: 'Number of Records' first, then
+    the XPaths in sorted order.
+    """
+    xpaths = pd.Index(xpaths, name='XPath').sort_values()
+    records = xpaths == 'Number of Records'
+    return xpaths[records].append(xpaths[~records])
+
+
+def _occurrenceColumns(CollectionComparisons):
+    """The CollectionOccurrence% of each collection of xpathOccurrence
+    tables, csv files or dataframes, as Series indexed by XPath.
+    """
+    for table in CollectionComparisons:
+        if isinstance(table, str):
+            table = readXpathOccurrence(
+                table, ['XPath', 'Collection', 'CollectionOccurrence%'])
+        for collection, rows in table.groupby('Collection', sort=False,
+                                              observed=True):
+            yield collection, pd.Series(
+                rows['CollectionOccurrence%'].to_numpy(dtype=float),
+                index=pd.Index(rows['XPath'].to_numpy(dtype=object),
+                               name='XPath'))
+
+
+def readCombinedOccurrence(location):
+    """Read a combined occurrence csv, as written by CombineXPathOccurrence
+    or updateCombinedOccurrence, indexed by XPath with a column for each
+    collection, the form updateCombinedOccurrence works on.
+    """
+    Combined = pd.read_csv(location, index_col='XPath')
+    Combined.columns = Combined.columns.astype(object)
+    return Combined.astype(float)
+
+
+def updateCombinedOccurrence(Combined, CollectionComparisons,
+                             DataDestination=None, to_csv=True):
+    """Upsert collections into a combined occurrence table instead of
+    combining every collection again. ``Combined`` is the table, indexed
+    by XPath as returned by this function or read by
+    readCombinedOccurrence, a combined occurrence csv, a table returned by
+    CombineXPathOccurrence, or None to start a new one.
+    ``CollectionComparisons`` are the xpathOccurrence tables, csv files
+    or dataframes, of new or updated collections. Only their columns are
+    replaced, and rows are only added for XPaths the table does not have
+    yet. The table is saved to ``DataDestination``, by default the csv it
+    was read from, in the format of CombineXPathOccurrence; there must be
+    one when ``to_csv`` is True. Returns the table indexed by XPath; a
+    table indexed by XPath is updated in place unless rows are added.
+    """
+    if isinstance(Combined, str):
+        if DataDestination is None:
+            DataDestination = Combined
+        Combined = readCombinedOccurrence(Combined)
+    elif Combined is None:
+        Combined = pd.DataFrame(index=pd.Index([], dtype=object, name='XPath'))
+    elif 'XPath' in Combined.columns:
+        Combined = Combined.set_index('XPath')
+    if to_csv and DataDestination is None:
+        raise ValueError('No DataDestination to save the combined occurrence '
+                         'table to')
+
+    columns = list(_occurrenceColumns(CollectionComparisons))
+    xpaths = Combined.index
+    for _, column in columns:
+        xpaths = xpaths.union(column.index)
+    if len(xpaths) != len(Combined.index):
+        Combined = Combined.reindex(_combinedRows(xpaths), fill_value=0.0)
+    for collection, column in columns:
+        Combined[collection] = column.reindex(
+            Combined.index, fill_value=0.0).to_numpy()
+
+    if to_csv:
+        lggr.info('Saving concept count report to %s' % DataDestination)
+        ConceptCountsDF = Combined[sorted(Combined.columns)]
+        ConceptCountsDF.columns.names = ['']
+        ConceptCountsDF.reset_index().to_csv(DataDestination, mode='w',
+                                             index=False)
+
+    return Combined
+
+
 def CombineXPathOccurrence(CollectionComparisons,
-                           DataDestination, to_csv=True):
+                           DataDestination, to_csv=True, vocabulary=None):
     """Using xpath occurrence data products, combine them and produce a
     collection occurrence% table with collections for columns and
     concepts for rows requires a list of xpathOccurrence csv.
-    It is required for CombinationSpreadsheet
+    It is required for CombinationSpreadsheet.
+    With an XPath ``vocabulary`` the tables are pivoted on XPath IDs.
     """
     DataDestinationDirectory = DataDestination[:DataDestination.rfind('/') + 1]
     os.makedirs(DataDestinationDirectory, exist_ok=True)
-    CombinedDF = pd.concat((pd.read_csv(f) for f in CollectionComparisons))
+    CombinedDF = pd.concat(
+        (readXpathOccurrence(f, ['XPath', 'Collection', 'CollectionOccurrence%'])
+         for f in CollectionComparisons))
+    if vocabulary is not None:
+        # the number of records row gets ID -1
+        records = (CombinedDF['XPath'] == 'Number of Records').to_numpy()
+        codes = np.full(len(CombinedDF), -1, dtype='int32')
+        codes[~records] = xpathCodes(CombinedDF['XPath'][~records], vocabulary)
+        CombinedDF['XPath'] = codes
     CombinedPivotDF = CombinedDF.pivot(
         index='XPath', columns='Collection', values='CollectionOccurrence%')
-
-    ConceptCountsDF = CombinedPivotDF.fillna(0)
+    if vocabulary is not None:
+        codes = CombinedPivotDF.index.to_numpy()
+        xpaths = np.full(len(codes), 'Number of Records', dtype=object)
+        xpaths[codes >= 0] = decodeXpaths(codes[codes >= 0], vocabulary)
+        CombinedPivotDF.index = pd.Index(xpaths, name='XPath')
+
+    ConceptCountsDF = CombinedPivotDF.reindex(
+        _combinedRows(CombinedPivotDF.index)).fillna(0)
     ConceptCountsDF.columns.names = ['']
     ConceptCountsDF = ConceptCountsDF.reset_index()
 
-    line = ConceptCountsDF[ConceptCountsDF['XPath'] == 'Number of Records']
-    ConceptCountsDF = pd.concat(
-        [ConceptCountsDF[0:0], line,
-         ConceptCountsDF[0:]]).reset_index(drop=True)
-    ConceptCountsDF.drop(
-        ConceptCountsDF.tail(1).index, inplace=True)
-
     if to_csv:
         lggr.info('Saving concept count report to %s' % DataDestination)
         ConceptCountsDF.to_csv(DataDestination, mode='w', index=False)
@@ -267,377 +2225,536 @@ def CombineXPathOccurrence(CollectionComparisons,
 
 
 
-def CombinationSpreadsheet(xpathOccurrence, recommendationOccurrence,
-                           RecommendationConcept, RecommendationGraph,
-                           RecGraphLink,
-                           DataDestination, AVGxpathOccurrence=None,
-                           AVGrecommendationOccurrence=None,
-                           recommendationCounts=None, xpathCounts=None,
-                           recommendationOccurrence2=None,
-                           RecommendationConcept2=None, RecommendationGraph2=None,
-                           RecGraphLink2=None, AVGrecommendationOccurrence2=None,
-                           recommendationCounts2=None):
-    # create spreadsheet for an organization
-    """requires each xpath and concept occurrence,
-    csv for a organization
-    (or any group of collections you want to compare)
+REPORT_CHUNK_ROWS = 10000
+SUMMARY_ROWS = 5000
+EXCEL_ERRORS = ('#DIV/0!', '#N/A', '#NAME?', '#NULL!', '#NUM!', '#REF!',
+                '#VALUE!')
+
+
+def _reportTable(table):
+    """A table of a report, a csv file or a dataframe such as those
+    returned by CombineXPathOccurrence, as a dataframe of the text of its
+    cells, so files and computed tables are written alike.
     """
+    if isinstance(table, str):
+        return pd.read_csv(table, dtype=str, keep_default_na=False)
+    table = table.astype(object)
+    table = table.where(table.notna(), '')
+    table.columns = [str(column) for column in table.columns]
+    return table.astype(str)
+
+
+def _reportChunks(table):
+    """A report table as dataframes of the text of its cells, read and
+    converted REPORT_CHUNK_ROWS rows at a time so a large table is never
+    held whole.
+    """
+    if isinstance(table, str):
+        chunks = pd.read_csv(table, dtype=str, keep_default_na=False,
+                             chunksize=REPORT_CHUNK_ROWS)
+    else:
+        chunks = (table.iloc[start:start + REPORT_CHUNK_ROWS]
+                  for start in range(0, max(len(table), 1), REPORT_CHUNK_ROWS))
+    for chunk in chunks:
+        yield _reportTable(chunk)
 
-    lggr.info('Saving spreadsheet %s' % DataDestination)
-    workbook = xlsxwriter.Workbook(DataDestination,
-                                   {'strings_to_numbers': True})
-    workbook.use_zip64()
-    cell_format11 = workbook.add_format()
-    cell_format11.set_num_format('0%')
-
-    cell_format04 = workbook.add_format()
-    cell_format04.set_num_format('0')
-    cell_format05 = workbook.add_format()
-    cell_format05.set_num_format('0.00')
-
-    formatGreen = workbook.add_format(
-        {'bg_color': '#C6EFCE', 'font_color': '#006100'})
-    formatRed = workbook.add_format(
-        {'bg_color': '#FFC7CE', 'font_color': '#9C0006'})
-    formatYellow = workbook.add_format(
-        {'bg_color': '#FFEB9C', 'font_color': '#9C6500'})
-    RecommendationConceptWS = workbook.add_worksheet(
-        'BestPractices2004_Concepts')
-    # RecommendationGraphWS = workbook.add_worksheet(
-    #    'RecommendationGraph')
-    # Insert an image with scaling.
-    RecommendationConceptWS.write('A29', "Full Image")
-    RecommendationConceptWS.write('B29', RecGraphLink)
-    RecommendationConceptWS.insert_image('A30', RecommendationGraph, {'x_scale': .07, 'y_scale': .07})
-
-    Reader = csv.reader(
-        open(RecommendationConcept, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    RecommendationConceptWS.set_row(0, None, cell_format04)
-    RecommendationConceptWS.set_row(2, None, cell_format04)
-    
-    for row in Reader:
-        for col in range(len(row)):
-            RecommendationConceptWS.write(row_count, col, row[col])
-            RecommendationConceptWS.set_column(col, col, 7, cell_format11)
-        row_count += 1
-    RecommendationConceptWS.set_column(0, 0, 20)
-    RecommendationConceptWS.set_column(1, 1, 15)
-    RecommendationConceptWS.set_column(2, 2, 20)
-    RecommendationAnalysisWS = workbook.add_worksheet(
-        'BestPractices2004_Elements')
-    RecommendationAnalysisWS.set_column(2, 4, 12)
-    recommendationoccurrenceWS = workbook.add_worksheet(
-        'BestPractices2004_Occurrence')
-    avgRecommendationOccurWS = workbook.add_worksheet(
-            'BestPractices2004_AVGoccurrence')
-    if recommendationCounts is not None:
-        recommendationcounts = workbook.add_worksheet('BestPractices2004_Counts')
-###################################################################
-# if a second recommendation
 
-    if recommendationOccurrence2 is not None:
+def _reportRows(table):
+    """The header and then the rows of a report table as lists of the text
+    of their cells, a chunk at a time.
+    """
+    for number, chunk in enumerate(_reportChunks(table)):
+        if number == 0:
+            yield list(chunk.columns)
+        yield from chunk.values.tolist()
 
-        RecommendationConcept2WS = workbook.add_worksheet(
-        'BestPractices2011_Concepts')
-        # RecommendationGraphWS = workbook.add_worksheet(
-        #    'RecommendationGraph')
-        # Insert an image with scaling.
-        RecommendationConcept2WS.write('A31', "Full Image")
-        RecommendationConcept2WS.write('B31', RecGraphLink2)
-        RecommendationConcept2WS.insert_image('A33', RecommendationGraph2, {'x_scale': .07, 'y_scale': .07})
-        
-        
-        Reader = csv.reader(
-            open(RecommendationConcept2, 'r'), delimiter=',', quotechar='"')
 
-        row_count = 0
-        RecommendationConcept2WS.set_row(0, None, cell_format04)
-        RecommendationConcept2WS.set_row(2, None, cell_format04)
-        
-        for row in Reader:
-            for col in range(len(row)):
-                RecommendationConcept2WS.write(row_count, col, row[col])
-                RecommendationConcept2WS.set_column(col, col, 7, cell_format11)
-            row_count += 1
-        RecommendationConcept2WS.set_column(0, 0, 20)
-        RecommendationConcept2WS.set_column(1, 1, 15)
-        RecommendationConcept2WS.set_column(2, 2, 20)
-        RecommendationAnalysis2WS = workbook.add_worksheet(
-            'BestPractices2011_Elements')
-        RecommendationAnalysis2WS.set_column(2, 4, 12)
-        recommendationoccurrence2WS = workbook.add_worksheet(
-            'BestPractices2011_Occurrence')
-        avgRecommendationOccur2WS = workbook.add_worksheet(
-                'BestPractices2011_AVGoccurrence')
-        if recommendationCounts2 is not None:
-            recommendationCounts2 = workbook.add_worksheet('BestPractices2011_Counts')
-
-        #######################################################################
-
-        RecommendationAnalysis2WS.set_column('A:A', 70)
-        RecommendationAnalysis2WS.set_column('B:B', 20)
-
-        recommendationoccurrence2WS.set_column('A:A', 70)
-        recommendationoccurrence2WS.hide()
-        Reader = csv.reader(
-            open(recommendationOccurrence2, 'r'), delimiter=',', quotechar='"')
-
-        row_count = 0
-        recommendationoccurrence2WS.set_row(1, None, cell_format04)
-        for row in Reader:
-            for col in range(len(row)):
-                recommendationoccurrence2WS.write(
-                    row_count, col, row[col])
-
-                recommendationoccurrence2WS.set_column(
-                    col, col, 15, cell_format11)
-            row_count += 1
-        Reader = csv.reader(
-            open(recommendationOccurrence2, 'r'), delimiter=',', quotechar='"')
-
-        row_count = 0
-        for row in Reader:
-            if Reader.line_num != 2:
-                for col in range(1, len(row)):
-                    RecommendationAnalysis2WS.write(
-                        row_count + 9, col + 4, row[col], cell_format11
-                    )
-
-                for col in range(0, 1):
-                    RecommendationAnalysis2WS.write(
-                        row_count + 9, col, row[col], cell_format11)
-
-                    Recommendationcell = xlsxwriter.utility.xl_rowcol_to_cell(
-                        row_count + 9, 0)
-                    formulaElementSimplifier = (
-                        '=MID(' + Recommendationcell +
-                        ',1+FIND("|",SUBSTITUTE(' + Recommendationcell +
-                        ',"/","|",LEN(' + Recommendationcell + ')-LEN(SUBSTITUTE(' +
-                        Recommendationcell + ',"/","")))),100)'
-                    )
-                    RecommendationAnalysis2WS.write(
-                        row_count + 9, col + 1, formulaElementSimplifier, cell_format11
-                    )
-                row_count += 1
-
-        avgRecommendationOccur2WS.set_column('A:A', 70)
-        avgRecommendationOccur2WS.hide()
-        
-        if AVGrecommendationOccurrence2 is not None:
-
-            Reader = csv.reader(
-                open(AVGrecommendationOccurrence2, 'r'), delimiter=',', quotechar='"')
-            row_count = 0
-            avgRecommendationOccur2WS.set_row(1, None, cell_format04)
-            for row in Reader:
-                for col in range(len(row)):
-                    avgRecommendationOccur2WS.write(
-                        row_count, col, row[col])
-                    avgRecommendationOccur2WS.set_column(col, col, 15, cell_format05)
-        RecommendationAnalysis2WS.write('A2', 'Number of records')
-        RecommendationAnalysis2WS.write('A3', 'Number of elements')
-        RecommendationAnalysis2WS.write(
-            'A4',
-            'Number of recommendation elements'
-        )
-        RecommendationAnalysis2WS.write('A5', 'Recommendation focus')
-        RecommendationAnalysis2WS.write('A6', 'Complete elements in the collection')
-        RecommendationAnalysis2WS.write('A7', 'Complete recommendation elements in the collection')
-        RecommendationAnalysis2WS.write(
-            'A8', 'Recommendation completeness focus')
-        RecommendationAnalysis2WS.write('A9', 'Upload Date')
-        RecommendationAnalysis2WS.write('B1', 'Formulas')
-        RecommendationAnalysis2WS.write('C1', 'MIN')
-        RecommendationAnalysis2WS.write('D1', 'MAX')
-        RecommendationAnalysis2WS.write('E1', 'AVG')
-        RecommendationAnalysis2WS.write('B10', 'Element Name')
-        RecommendationAnalysis2WS.write('C10', 'Collections')
-        RecommendationAnalysis2WS.write('D10', 'Complete')
-        RecommendationAnalysis2WS.write('E10', 'Partial')
-
-        Reader = csv.reader(
-            open(recommendationOccurrence2, 'r'), delimiter=',', quotechar='"')
-
-        row_count = 0
-        for row in Reader:
-            for col in range(len(row) - 1):
-                ElementTotal = xlsxwriter.utility.xl_rowcol_to_cell(5, col + 5)
-                RecommendationElementTotal = xlsxwriter.utility.xl_rowcol_to_cell(6, col + 5)
-                cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-                cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
-                cell4 = xlsxwriter.utility.xl_rowcol_to_cell(3, col + 5)
-                colRange = xlsxwriter.utility.xl_range(2, col + 1, 5000, col + 1)
-                colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, len(row) + 3)
-
-                formula2 = '=COUNTIF(XpathOccurrence!' + colRange + ',">"&0)'
-                RecommendationAnalysis2WS.write(2, col + 5, formula2)
-
-                formula3 = '=COUNTIF(BestPractices2011_Occurrence!' + colRange + ',">"&0)'
-                RecommendationAnalysis2WS.write(3, col + 5, formula3)
-
-                formula4 = '='+cell4+'/'+cell3
-                RecommendationAnalysis2WS.write(4, col + 5, formula4, cell_format11)
-
-                formula5 = '=COUNTIF(XpathOccurrence!' + colRange + ',"=1")/'+cell3 
-                RecommendationAnalysis2WS.write(5, col + 5, formula5, cell_format11)
-
-                formula6 = '=COUNTIF(BestPractices2011_Occurrence!' + colRange + ',"=1")/'+cell3
-                RecommendationAnalysis2WS.write(6, col + 5, formula6, cell_format11)
-
-                formula7 = '='+RecommendationElementTotal+'/'+ElementTotal
-                RecommendationAnalysis2WS.write(7, col + 5, formula7, cell_format11)
-
-                formula1 = (
-                    '=VLOOKUP("Number of Records",BestPractices2011_Occurrence!1:1048576,' +
-                    str(col + 2) + ', False)'
-                )
-                RecommendationAnalysis2WS.write(1, col + 5, formula1, cell_format04)
-
-                formula = '=BestPractices2011_Occurrence!' + '%s' % cell2
-                RecommendationAnalysis2WS.write(0, col + 5, formula)
-                dateFormula = (
-                    '=LEFT(RIGHT(BestPractices2011_Occurrence!' + '%s' % cell2 +
-                    ',LEN(BestPractices2011_Occurrence!' + '%s' % cell2 +
-                    ')-FIND("_", BestPractices2011_Occurrence!' +
-                    '%s' % cell2 + ')-1),FIND("_",BestPractices2011_Occurrence!' +
-                    '%s' % cell2 + ')+1)'
-                )
-                RecommendationAnalysis2WS.write(8, col + 5, dateFormula)
-                collectFormula = (
-                    '=LEFT(BestPractices2011_Occurrence!' + '%s' % cell2 +
-                    ',FIND("_",BestPractices2011_Occurrence!' + '%s' % cell2 + ')-1)'
-                )
+def _cellNumbers(table):
+    """The numbers the cells of a report table become in the workbook,
+    where strings_to_numbers turns any finite number into one; other cells
+    are NaN.
+    """
+    numbers = table.apply(pd.to_numeric, errors='coerce').astype(float)
+    return numbers.where(np.isfinite(numbers))
 
-                RecommendationAnalysis2WS.write(9, col + 5, collectFormula)
-
-            row_count += 1
-        #######################################################################
-
-        if recommendationCounts2 is not None:
-            Reader = csv.reader(
-                open(recommendationCounts2, 'r'), delimiter=',', quotechar='"')
-            row_count = 0
-
-            for row in Reader:
-                for col in range(len(row)):
-                    recommendationCounts2.write(
-                        row_count, col, row[col], cell_format04)
-                row_count += 1
-            Reader = csv.reader(
-                open(recommendationCounts2, 'r'), delimiter=',', quotechar='"')
-            row_count = 0
-            absRowCount = sum(1 for row in Reader)
-            absColCount = len(next(csv.reader(
-                open(recommendationCounts2, 'r'), delimiter=',', quotechar='"')))
-            recommendationCounts2.autofilter(0, 0, absRowCount - 1, absColCount - 1)
 
-        
-        for row in range(1, 4):
-            absColCount = len(next(csv.reader(
-                open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"'
-            )))
-            colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 3 + absColCount)
-            miniFormula = '=MIN(' + colRange4 + ')'
-            RecommendationAnalysis2WS.write(row, 2, miniFormula, cell_format04)
-            maxiFormula = '=MAX(' + colRange4 + ')'
-            RecommendationAnalysis2WS.write(row, 3, maxiFormula, cell_format04)
-            avgFormula = '=AVERAGE(' + colRange4 + ')'
-            RecommendationAnalysis2WS.write(row, 4, avgFormula, cell_format04)
-
-        for row in range(4, 8):
-            absColCount = len(next(csv.reader(
-                open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"'
-            )))
-            colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 3 + absColCount)
-            miniFormula = '=MIN(' + colRange4 + ')'
-            RecommendationAnalysis2WS.write(row, 2, miniFormula, cell_format11)
-            maxiFormula = '=MAX(' + colRange4 + ')'
-            RecommendationAnalysis2WS.write(row, 3, maxiFormula, cell_format11)
-            avgFormula = '=AVERAGE(' + colRange4 + ')'
-            RecommendationAnalysis2WS.write(row, 4, avgFormula, cell_format11)
-
-        Reader = csv.reader(
-            open(recommendationOccurrence2, 'r'), delimiter=',', quotechar='"'
-        )
-        absRowCount = sum(1 for row in Reader)
-        absColCount = len(next(csv.reader(
-            open(recommendationOccurrence2, 'r'), delimiter=',', quotechar='"'
-        )))
-
-        RecommendationAnalysis2WS.autofilter(9, 0, absRowCount + 7, absColCount + 3)
-        recommendationoccurrence2WS.autofilter(
-            0, 0, absRowCount - 2, absColCount - 1)
-        avgRecommendationOccur2WS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
-
-        RecommendationAnalysis2WS.conditional_format(
-            10, 5, absRowCount + 8, absColCount +
-            3,
-            {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-        )
-        RecommendationAnalysis2WS.conditional_format(
-            10, 5, absRowCount + 8, absColCount + 3,
-            {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-        )
-        RecommendationAnalysis2WS.conditional_format(
-            10, 5, absRowCount + 8, absColCount + 3,
-            {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-        )
-        recommendationoccurrence2WS.conditional_format(
-            2, 1, absRowCount - 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-        )
-        recommendationoccurrence2WS.conditional_format(
-            2, 1, absRowCount - 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-        )
-        recommendationoccurrence2WS.conditional_format(
-            2, 1, absRowCount - 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-        )
-        avgRecommendationOccur2WS.conditional_format(
-            2, 1, absRowCount - 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-        avgRecommendationOccur2WS.conditional_format(
-            2, 1, absRowCount - 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-        avgRecommendationOccur2WS.conditional_format(
-            2, 1, absRowCount - 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-
-        RecommendationConcept2WS.conditional_format(
-            3, 3, 28, absColCount + 1,
-            {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-        )
-        RecommendationConcept2WS.conditional_format(
-            3, 3, 28, absColCount + 1,
-            {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-        )
-        RecommendationConcept2WS.conditional_format(
-            3, 3, 28, absColCount + 1,
-            {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-        )
-        RecommendationConcept2WS.conditional_format(
-            1, 3, 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
+def _cellValue(text):
+    """The value a formula gets from a cell holding ``text``: a number
+    where strings_to_numbers made one, 0 for a blank cell, else the text.
+    """
+    if text == '':
+        return 0
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return number if np.isfinite(number) else text
+
+
+def _summaryMetrics(table):
+    """The values the summary formulas of an analysis sheet take from an
+    occurrence table, by collection: the header, the number of records,
+    and the number of elements that are present, complete (exactly 1), at
+    least complete and partial in the rows the formulas range over, the
+    first SUMMARY_ROWS - 1 below the number of records, with their sum.
+    """
+    if isinstance(table, str):
+        head = pd.read_csv(table, dtype=str, keep_default_na=False,
+                           nrows=SUMMARY_ROWS)
+    else:
+        head = table.iloc[:SUMMARY_ROWS]
+    head = _reportTable(head)
+    numbers = _cellNumbers(head.iloc[1:, 1:])
+    records = head[head.iloc[:, 0].str.lower() == 'number of records']
+    return {
+        'Columns': list(head.columns),
+        'Header': list(head.columns[1:]),
+        'Records': ([_cellValue(value) for value in records.iloc[0, 1:]]
+                    if len(records) else ['#N/A'] * (head.shape[1] - 1)),
+        'Elements': (numbers > 0).sum().tolist(),
+        'Complete': (numbers == 1).sum().tolist(),
+        'AtLeastComplete': (numbers >= 1).sum().tolist(),
+        'Partial': ((numbers > 0) & (numbers < 1)).sum().tolist(),
+        'Sum': numbers.sum().tolist()}
+
+
+def _metric(metrics, name, col):
+    """A summary metric of the collection in column ``col``; past the last
+    collection the formulas find blank cells.
+    """
+    if col < len(metrics[name]):
+        return metrics[name][col]
+    return '' if name == 'Header' else 0
+
+
+def _excelDivide(numerator, denominator):
+    """numerator/denominator as a formula computes it, errors included."""
+    for value in (numerator, denominator):
+        if isinstance(value, str):
+            return value if value in EXCEL_ERRORS else '#VALUE!'
+    if denominator == 0:
+        return '#DIV/0!'
+    return numerator / denominator
+
+
+def _excelAggregate(function, values):
+    """MIN, MAX or AVERAGE of ``values`` as a formula computes it over a
+    range: text is skipped and the first error is the result.
+    """
+    for value in values:
+        if isinstance(value, str) and value in EXCEL_ERRORS:
+            return value
+    numbers = [value for value in values if not isinstance(value, str)]
+    if function == 'AVERAGE':
+        return _excelDivide(sum(numbers), len(numbers))
+    if not numbers:
+        return 0
+    return min(numbers) if function == 'MIN' else max(numbers)
+
+
+def _aggregateValues(cells, rows, lastCol):
+    """Give the MIN, MAX and AVERAGE formulas in columns C to E of ``rows``
+    of a summary the values they compute over columns F to ``lastCol``.
+    """
+    for row in rows:
+        values = [cells[row, col][2] for col in range(5, lastCol + 1)
+                  if len(cells.get((row, col), ())) == 3]
+        for col, function in zip((2, 3, 4), ('MIN', 'MAX', 'AVERAGE')):
+            cells[row, col] = cells[row, col][:2] + (
+                _excelAggregate(function, values),)
+
+
+def _uploadDate(header, separator):
+    """The value of the upload date formula of a collection header,
+    LEFT(RIGHT(h,LEN(h)-FIND("_",h)-1),FIND(separator,h)+1).
+    """
+    first, second = header.find('_'), header.find(separator)
+    count = len(header) - first - 2
+    if first < 0 or second < 0 or count < 0:
+        return '#VALUE!'
+    return header[len(header) - count:][:second + 2]
+
+
+def _headerCollection(header):
+    """The value of the collection formula of a collection header,
+    LEFT(h,FIND("_",h)-1).
+    """
+    if '_' not in header:
+        return '#VALUE!'
+    return header[:header.find('_')]
+
+
+def _elementNames(xpaths):
+    """The values of the element name formulas of a series of XPaths,
+    the text after the first "|" once the last "/" is replaced by one.
+    """
+    head, separator, tail = (xpaths.str.rpartition('/')[part]
+                             for part in (0, 1, 2))
+    piped = head.str.contains('|', regex=False)
+    names = tail.where(~piped, head.str.partition('|')[2] + '|' + tail)
+    names = names.str[:100]
+    return names.where(separator != '', '#VALUE!').tolist()
+
+
+def _writeRows(worksheet, header, rows, cellFormat=None):
+    """Write ``header`` and then ``rows`` to ``worksheet`` from its first
+    cell, a row at a time, and return the number of rows written.
+    """
+    worksheet.write_row(0, 0, header, cellFormat)
+    count = 1
+    for count, row in enumerate(rows, 2):
+        worksheet.write_row(count - 1, 0, row, cellFormat)
+    return count
+
+
+def _tableCells(rows, cells):
+    """Add the non-empty cells of a small table, as rows of text, to
+    ``cells``, a dict of (row, col) to the value and format of a cell, over
+    the cells already there.
+    """
+    for row, values in enumerate(rows):
+        for col, value in enumerate(values):
+            if value != '':
+                cells[row, col] = (value,)
+    return cells
+
+
+def _writeCells(worksheet, cells, formulas=True, cachedValues=False):
+    """Write ``cells``, a dict of (row, col) to the value and format of a
+    cell, in row order. Sheets set out cell by cell, like the concept
+    tables and the summaries of the analysis sheets, are gathered this way
+    so a streamed sheet never goes back to a row already written.
+
+    A formula cell can carry its value computed in Python as a third item,
+    written as the cached result of the formula with cachedValues, or in
+    place of the formula without formulas.
+    """
+    for row, col in sorted(cells):
+        cell = cells[row, col]
+        if len(cell) < 3 or (formulas and cachedValues):
+            worksheet.write(row, col, *cell)
+        elif formulas:
+            worksheet.write(row, col, *cell[:2])
+        elif isinstance(cell[2], str):
+            worksheet.write_string(row, col, cell[2], cell[1])
+        else:
+            worksheet.write_number(row, col, cell[2], cell[1])
+
+
+def _writeOccurrenceRows(occurrenceWS, analysisWS, table, cellFormat,
+                         formulas=True, cachedValues=False):
+    """Write an occurrence table to its sheet and, without the number of
+    records, below the summary of its analysis sheet: the XPath in column
+    A with the formula of its element name in B, the number of collections
+    it is in, complete or partial in C to E, and the collections from
+    column F. Both sheets are written a row at a time; the values of the
+    formulas are computed a chunk at a time when they are cached or
+    written instead. Returns the number of rows of the table.
+    """
+    count = 0
+    for chunk in _reportChunks(table):
+        if count == 0:
+            occurrenceWS.write_row(0, 0, list(chunk.columns))
+            count = 1
+        width = chunk.shape[1]
+        if not formulas or cachedValues:
+            numbers = _cellNumbers(chunk.iloc[:, 1:])
+            present = (numbers > 0).sum(axis=1).tolist()
+            complete = (numbers == 1).sum(axis=1).tolist()
+            partial = ((numbers < 1).sum(axis=1) -
+                       (numbers == 0).sum(axis=1)).tolist()
+            names = _elementNames(chunk.iloc[:, 0])
+        for number, row in enumerate(chunk.values.tolist()):
+            occurrenceWS.write_row(count, 0, row)
+            count += 1
+            if count < 3:
+                continue
+            line = count + 7
+            cell = xlsxwriter.utility.xl_rowcol_to_cell(line, 0)
+            colRange = xlsxwriter.utility.xl_range(line, 5, line, width + 3)
+            analysisWS.write(line, 0, row[0], cellFormat)
+            if not formulas:
+                analysisWS.write_string(line, 1, names[number], cellFormat)
+                analysisWS.write_row(line, 2, [
+                    present[number], complete[number], partial[number]])
+                analysisWS.write_row(line, 5, row[1:], cellFormat)
+                continue
+            cells = [
+                ('=MID(' + cell + ',1+FIND("|",SUBSTITUTE(' + cell +
+                 ',"/","|",LEN(' + cell + ')-LEN(SUBSTITUTE(' + cell +
+                 ',"/","")))),100)', cellFormat),
+                ('=COUNTIF(' + colRange + ',">"&0)', None),
+                ('=COUNTIF(' + colRange + ',"="&1)', None),
+                ('=COUNTIF(' + colRange + ',"<"&1)-COUNTIF(' + colRange +
+                 ',"=0")', None)]
+            if cachedValues:
+                cells = [formula + (value,) for formula, value in zip(cells, [
+                    names[number], present[number], complete[number],
+                    partial[number]])]
+            for col, formula in enumerate(cells, 1):
+                analysisWS.write_formula(line, col, *formula)
+            analysisWS.write_row(line, 5, row[1:], cellFormat)
+    return count
+
+
+RecommendationResults = collections.namedtuple(
+    'RecommendationResults',
+    ['Name', 'Occurrence', 'Concept', 'Graph', 'GraphLink',
+     'AVGoccurrence', 'Counts'],
+    defaults=(None, None))
+RecommendationResults.__doc__ = """The results of a recommendation for a
+report. ``Name`` prefixes its sheets, ``Occurrence``, ``Concept``,
+``AVGoccurrence`` and ``Counts`` are its tables as csv files or dataframes,
+and ``Graph`` is its radar image, with ``GraphLink`` to the full image.
+"""
+
+
+def _reportFormats(workbook):
+    """The formats of a report, registered once with ``workbook`` and
+    shared by all of its sheets.
+    """
+    return {
+        'percent': workbook.add_format({'num_format': '0%'}),
+        'whole': workbook.add_format({'num_format': '0'}),
+        'decimal': workbook.add_format({'num_format': '0.00'}),
+        'green': workbook.add_format(
+            {'bg_color': '#C6EFCE', 'font_color': '#006100'}),
+        'red': workbook.add_format(
+            {'bg_color': '#FFC7CE', 'font_color': '#9C0006'}),
+        'yellow': workbook.add_format(
+            {'bg_color': '#FFEB9C', 'font_color': '#9C6500'})}
+
+
+def _setColumns(worksheet, columns):
+    """Set the columns of ``worksheet`` from ``columns``, ranges of
+    (first, last, width, format) where later ranges override earlier ones,
+    with one set_column call for each run of columns set alike.
+    """
+    settings = {}
+    for first, last, width, cellFormat in columns:
+        for col in range(first, last + 1):
+            settings[col] = (width, cellFormat)
+    runs = []
+    for col in sorted(settings):
+        if runs and runs[-1][1] == col - 1 and runs[-1][2] == settings[col]:
+            runs[-1][1] = col
+        else:
+            runs.append([col, col, settings[col]])
+    for first, last, (width, cellFormat) in runs:
+        worksheet.set_column(first, last, width, cellFormat)
+
+
+def _conditionalFormats(worksheet, firstRow, firstCol, lastRow, lastCol,
+                        formats):
+    """Colour a range of occurrences green from 1, yellow at 0 and red at
+    -1.
+    """
+    for criteria, value, colour in (('>=', 1, 'green'), ('=', 0, 'yellow'),
+                                    ('=', -1, 'red')):
+        worksheet.conditional_format(
+            firstRow, firstCol, lastRow, lastCol,
+            {'type': 'cell', 'criteria': criteria, 'value': value,
+             'format': formats[colour]})
+
+
+def _aggregateFormulas(cells, rows, lastCol, cellFormat):
+    """Add the MIN, MAX and AVERAGE over columns F to ``lastCol`` of
+    ``rows`` of a summary to its columns C to E.
+    """
+    for row in rows:
+        colRange = xlsxwriter.utility.xl_range(row, 5, row, lastCol)
+        for col, function in zip((2, 3, 4), ('MIN', 'MAX', 'AVERAGE')):
+            cells[row, col] = ('=' + function + '(' + colRange + ')',
+                               cellFormat)
+
+
+def _writeRecommendationSheets(workbook, recommendation, xpathMetrics,
+                               formats, formulas=True, cachedValues=False):
+    """Add the concept, elements, occurrence, average occurrence and counts
+    sheets of a recommendation, RecommendationResults, to ``workbook``.
+    """
+    name = recommendation.Name
+    occurrence = name + '_Occurrence!'
+    metrics = _summaryMetrics(recommendation.Occurrence)
+    header = metrics['Columns']
+    absColCount = len(header)
+
+    conceptWS = workbook.add_worksheet(name + '_Concepts')
+    concept = list(_reportRows(recommendation.Concept))
+    # Insert an image with scaling below the concept table.
+    conceptWS.insert_image(len(concept) + 1, 0, recommendation.Graph,
+                           {'x_scale': .07, 'y_scale': .07})
+    conceptWS.set_row(0, None, formats['whole'])
+    conceptWS.set_row(2, None, formats['whole'])
+    _setColumns(conceptWS, [(0, len(concept[0]) - 1, 7, formats['percent']),
+                            (0, 0, 20, None), (1, 1, 15, None),
+                            (2, 2, 20, None)])
+    _writeCells(conceptWS, _tableCells(
+        concept, {(len(concept), 0): ("Full Image",),
+                  (len(concept), 1): (recommendation.GraphLink,)}))
+    _conditionalFormats(conceptWS, 3, 3, 28, absColCount + 1, formats)
+    _conditionalFormats(conceptWS, 1, 3, 1, absColCount - 1, formats)
+
+    analysisWS = workbook.add_worksheet(name + '_Elements')
+    occurrenceWS = workbook.add_worksheet(name + '_Occurrence')
+    avgOccurWS = workbook.add_worksheet(name + '_AVGoccurrence')
+    if recommendation.Counts is not None:
+        countsWS = workbook.add_worksheet(name + '_Counts')
+
+    _setColumns(analysisWS, [(2, 4, 12, None), (0, 0, 70, None),
+                             (1, 1, 20, None)])
+    occurrenceWS.hide()
+    _setColumns(occurrenceWS, [(0, absColCount - 1, 15, formats['percent'])])
+    avgOccurWS.hide()
+    if recommendation.AVGoccurrence is not None:
+        avgRows = _reportRows(recommendation.AVGoccurrence)
+        avgHeader = next(avgRows)
+        avgOccurWS.set_row(1, None, formats['whole'])
+        _setColumns(avgOccurWS,
+                    [(0, len(avgHeader) - 1, 15, formats['decimal'])])
+        _writeRows(avgOccurWS, avgHeader, avgRows)
+    else:
+        _setColumns(avgOccurWS, [(0, 0, 70, None)])
+
+    summary = {(9, 0): (header[0], formats['percent'])}
+    summary[1, 0] = ('Number of records',)
+    summary[2, 0] = ('Number of elements',)
+    summary[3, 0] = ('Number of recommendation elements',)
+    summary[4, 0] = ('Recommendation focus',)
+    summary[5, 0] = ('Complete elements in the collection',)
+    summary[6, 0] = ('Complete recommendation elements in the collection',)
+    summary[7, 0] = ('Recommendation completeness focus',)
+    summary[8, 0] = ('Upload Date',)
+    summary[0, 1] = ('Formulas',)
+    summary[0, 2] = ('MIN',)
+    summary[0, 3] = ('MAX',)
+    summary[0, 4] = ('AVG',)
+    summary[9, 1] = ('Element Name',)
+    summary[9, 2] = ('Collections',)
+    summary[9, 3] = ('Complete',)
+    summary[9, 4] = ('Partial',)
+
+    for col in range(absColCount - 1):
+        collection = _metric(metrics, 'Header', col)
+        elements = _metric(xpathMetrics, 'Elements', col)
+        recommendationElements = _metric(metrics, 'Elements', col)
+        completeElements = _excelDivide(
+            _metric(xpathMetrics, 'Complete', col), elements)
+        completeRecommendationElements = _excelDivide(
+            _metric(metrics, 'Complete', col), elements)
+        ElementTotal = xlsxwriter.utility.xl_rowcol_to_cell(5, col + 5)
+        RecommendationElementTotal = xlsxwriter.utility.xl_rowcol_to_cell(6, col + 5)
+        cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
+        cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
+        cell4 = xlsxwriter.utility.xl_rowcol_to_cell(3, col + 5)
+        colRange = xlsxwriter.utility.xl_range(2, col + 1, SUMMARY_ROWS, col + 1)
+
+        formula2 = '=COUNTIF(XpathOccurrence!' + colRange + ',">"&0)'
+        summary[2, col + 5] = (formula2, None, elements)
+
+        formula3 = '=COUNTIF(' + occurrence + colRange + ',">"&0)'
+        summary[3, col + 5] = (formula3, None, recommendationElements)
+
+        formula4 = '='+cell4+'/'+cell3
+        summary[4, col + 5] = (formula4, formats['percent'],
+            _excelDivide(recommendationElements, elements))
+
+        formula5 = '=COUNTIF(XpathOccurrence!' + colRange + ',"=1")/'+cell3
+        summary[5, col + 5] = (formula5, formats['percent'], completeElements)
+
+        formula6 = '=COUNTIF(' + occurrence + colRange + ',"=1")/'+cell3
+        summary[6, col + 5] = (formula6, formats['percent'],
+            completeRecommendationElements)
+
+        formula7 = '='+RecommendationElementTotal+'/'+ElementTotal
+        summary[7, col + 5] = (formula7, formats['percent'],
+            _excelDivide(completeRecommendationElements, completeElements))
+
+        formula1 = (
+            '=VLOOKUP("Number of Records",' + occurrence + '1:1048576,' +
+            str(col + 2) + ', False)'
         )
-        RecommendationConcept2WS.conditional_format(
-            1, 3, 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
+        summary[1, col + 5] = (formula1, formats['whole'],
+            _metric(metrics, 'Records', col))
+
+        formula = '=' + occurrence + cell2
+        summary[0, col + 5] = (formula, None, _cellValue(collection))
+        dateFormula = (
+            '=LEFT(RIGHT(' + occurrence + cell2 +
+            ',LEN(' + occurrence + cell2 +
+            ')-FIND("_", ' + occurrence + cell2 +
+            ')-1),FIND("_",' + occurrence + cell2 + ')+1)'
         )
-        RecommendationConcept2WS.conditional_format(
-            1, 3, 1, absColCount - 1,
-            {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
+        summary[8, col + 5] = (dateFormula, None,
+            _uploadDate(collection, '_'))
+        collectFormula = (
+            '=LEFT(' + occurrence + cell2 +
+            ',FIND("_",' + occurrence + cell2 + ')-1)'
         )
-        for row in range(10, absRowCount + 8):
-            colRange5 = xlsxwriter.utility.xl_range(row, 5, row, absColCount + 3)
-            numbCollectFormula = '=COUNTIF(' + colRange5 + ',">"&0)'
-            CompleteCollectFormula = '=COUNTIF(' + colRange5 + ',"="&1)'
-            GreatCollectFormula = '=COUNTIF(' + colRange5 + ',"<"&1)-COUNTIF('+ colRange5 + ',"=0")'
-            RecommendationAnalysis2WS.write(row, 2, numbCollectFormula)
-            RecommendationAnalysis2WS.write(row, 3, CompleteCollectFormula)
-            RecommendationAnalysis2WS.write(row, 4, GreatCollectFormula)
+        summary[9, col + 5] = (collectFormula, None,
+            _headerCollection(collection))
+
+    if recommendation.Counts is not None:
+        countsRows = _reportRows(recommendation.Counts)
+        countsHeader = next(countsRows)
+        countsRowCount = _writeRows(countsWS, countsHeader, countsRows,
+                                    formats['whole'])
+        countsWS.autofilter(0, 0, countsRowCount - 1, len(countsHeader) - 1)
+
+    _aggregateFormulas(summary, range(1, 4), 3 + absColCount,
+                       formats['whole'])
+    _aggregateFormulas(summary, range(4, 8), 3 + absColCount,
+                       formats['percent'])
+    _aggregateValues(summary, range(1, 8), 3 + absColCount)
+
+    _writeCells(analysisWS, summary, formulas, cachedValues)
+    occurrenceWS.set_row(1, None, formats['whole'])
+    absRowCount = _writeOccurrenceRows(
+        occurrenceWS, analysisWS, recommendation.Occurrence,
+        formats['percent'], formulas, cachedValues)
+
+    analysisWS.autofilter(9, 0, absRowCount + 7, absColCount + 3)
+    occurrenceWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
+    avgOccurWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
+
+    _conditionalFormats(analysisWS, 10, 5, absRowCount + 8, absColCount + 3,
+                        formats)
+    _conditionalFormats(occurrenceWS, 2, 1, absRowCount - 1, absColCount - 1,
+                        formats)
+    _conditionalFormats(avgOccurWS, 2, 1, absRowCount - 1, absColCount - 1,
+                        formats)
+
+
+def RecommendationSpreadsheet(recommendations, xpathOccurrence,
+                              DataDestination, AVGxpathOccurrence=None,
+                              xpathCounts=None, constantMemory=False,
+                              formulas=True, cachedValues=False):
+    # create spreadsheet for an organization
+    """requires each xpath occurrence and the RecommendationResults of any
+    number of recommendations for a organization
+    (or any group of collections you want to compare), each written to its
+    own set of sheets ahead of the XPath sheets.
+    The tables can be csv files or dataframes; they are read in chunks and
+    every sheet is written in row order, so with constantMemory the
+    workbook is streamed in xlsxwriter's constant_memory mode and memory
+    does not grow with the number of XPaths and collections.
+    The summary formulas of the analysis sheets are also computed in
+    Python; with cachedValues they are stored as the cached results of the
+    formulas, and without formulas they are written in their place.
+    """
+
+    lggr.info('Saving spreadsheet %s' % DataDestination)
+    xpathMetrics = _summaryMetrics(xpathOccurrence)
+    xpathHeader = xpathMetrics['Columns']
+    workbook = xlsxwriter.Workbook(DataDestination,
+                                   {'strings_to_numbers': True,
+                                    'constant_memory': constantMemory})
+    workbook.use_zip64()
+    formats = _reportFormats(workbook)
+
+    for recommendation in recommendations:
+        _writeRecommendationSheets(workbook, recommendation, xpathMetrics,
+                                   formats, formulas, cachedValues)
 
 ###################################################################
     XpathAnalysisWS = workbook.add_worksheet('AllXpaths')
@@ -645,99 +2762,72 @@ def CombinationSpreadsheet(xpathOccurrence, recommendationOccurrence,
     avgXpathOccurWS = workbook.add_worksheet('AVGxpathOccurrence')
     if xpathCounts is not None:
         xpathcounts = workbook.add_worksheet('XpathCounts')
-    XpathAnalysisWS.set_column('A:A', 70)
-    XpathAnalysisWS.set_column('B:B', 20)
-    recommendationoccurrenceWS.hide()
+    _setColumns(XpathAnalysisWS, [(0, 0, 70, None), (1, 1, 20, None)])
     xpathoccurrenceWS.hide()
     avgXpathOccurWS.hide()
-    avgRecommendationOccurWS.hide()
-    xpathoccurrenceWS.set_column('A:A', 70)
-
-    Reader = csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    xpathoccurrenceWS.set_row(1, None, cell_format04)
-    for row in Reader:
-        for col in range(len(row)):
-            xpathoccurrenceWS.write(row_count, col, row[col])
-            xpathoccurrenceWS.set_column(col, col, 15, cell_format11)
-        row_count += 1
-
-    Reader = csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    for row in Reader:
-        if Reader.line_num != 2:
-            for col in range(1, len(row)):
-                XpathAnalysisWS.write(
-                    row_count + 9, col + 4, row[col], cell_format11
-                )
 
-            for col in range(0, 1):
-                XpathAnalysisWS.write(row_count + 9, col, row[col], cell_format11)
+    _setColumns(xpathoccurrenceWS,
+                [(0, len(xpathHeader) - 1, 15, formats['percent'])])
+    xpathSummary = {(9, 0): (xpathHeader[0], formats['percent'])}
 
-                Xpathcell = xlsxwriter.utility.xl_rowcol_to_cell(row_count + 9, 0)
-                formulaElementSimplifier = (
-                    '=MID(' + Xpathcell +
-                    ',1+FIND("|",SUBSTITUTE(' + Xpathcell +
-                    ',"/","|",LEN(' + Xpathcell + ')-LEN(SUBSTITUTE(' +
-                    Xpathcell + ',"/","")))),100)'
-                )
-                XpathAnalysisWS.write(
-                    row_count + 9, col + 1, formulaElementSimplifier, cell_format11
-                )
-            row_count += 1
+    avgXpathOccurWS.set_row(1, None, formats['whole'])
     if AVGxpathOccurrence is not None:
-        avgXpathOccurWS.set_column('A:A', 70)
-
-        Reader = csv.reader(
-        open(AVGxpathOccurrence, 'r'), delimiter=',', quotechar='"')
-    row_count = 0
-    avgXpathOccurWS.set_row(1, None, cell_format04)
-    for row in Reader:
-        for col in range(len(row)):
-            avgXpathOccurWS.write(row_count, col, row[col])
-            avgXpathOccurWS.set_column(col, col, 15, cell_format05)
-
-        for col in range(len(row) - 1):
-
+        avgRows = _reportRows(AVGxpathOccurrence)
+        avgHeader = next(avgRows)
+        _setColumns(avgXpathOccurWS,
+                    [(0, len(avgHeader) - 1, 15, formats['decimal'])])
+        _writeRows(avgXpathOccurWS, avgHeader, avgRows)
+
+        mostElements = _excelAggregate('MAX', [
+            _metric(xpathMetrics, 'Elements', col)
+            for col in range(len(avgHeader) - 1)])
+        for col in range(len(avgHeader) - 1):
+            header = _metric(xpathMetrics, 'Header', col)
+            elements = _metric(xpathMetrics, 'Elements', col)
+            completeElements = _excelDivide(
+                _metric(xpathMetrics, 'AtLeastComplete', col), elements)
+            partialElements = _excelDivide(
+                _metric(xpathMetrics, 'Partial', col), elements)
             cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
             cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
-            colRange = xlsxwriter.utility.xl_range(2, col + 1, 5000, col + 1)
-            colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, len(row) + 3)
+            colRange = xlsxwriter.utility.xl_range(2, col + 1, SUMMARY_ROWS, col + 1)
+            colRange2 = xlsxwriter.utility.xl_range(
+                2, 5, 2, len(avgHeader) + 3)
 
             formula2 = '=COUNTIF(xpathOccurrence!' + colRange + ',">"&0)'
-            XpathAnalysisWS.write(2, col + 5, formula2)
+            xpathSummary[2, col + 5] = (formula2, None, elements)
 
             formula6 = (
                 '=COUNTIF(xpathOccurrence!' +
                 colRange + ',">="&1)/' + '%s' % cell3
             )
-            XpathAnalysisWS.write(6, col + 5, formula6, cell_format11)
+            xpathSummary[6, col + 5] = (formula6, formats['percent'], completeElements)
 
             formula7 = (
                 '=COUNTIFS(xpathOccurrence!' +
                 colRange + ',">"&0,xpathOccurrence!' +
                 colRange + ',"<"&1)/' + '%s' % cell3
             )
-            XpathAnalysisWS.write(7, col + 5, formula7, cell_format11)
+            xpathSummary[7, col + 5] = (formula7, formats['percent'], partialElements)
 
             formula1 = (
                 '=VLOOKUP("Number of Records",xpathOccurrence!1:1048576,' +
                 str(col + 2) + ', False)'
             )
-            XpathAnalysisWS.write(1, col + 5, formula1, cell_format04)
+            xpathSummary[1, col + 5] = (
+                formula1, formats['whole'], _metric(xpathMetrics, 'Records', col))
 
             cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
             formula4 = '=SUM(xpathOccurrence!' + colRange + ')/' + '%s' % cell3
-            XpathAnalysisWS.write(4, col + 5, formula4, cell_format11)
+            xpathSummary[4, col + 5] = (
+                formula4, formats['percent'],
+                _excelDivide(_metric(xpathMetrics, 'Sum', col), elements))
 
             formula5 = '=' + '%s' % cell3 + '/MAX(' + colRange2 + ')'
-            XpathAnalysisWS.write(5, col + 5, formula5, cell_format11)
+            xpathSummary[5, col + 5] = (
+                formula5, formats['percent'], _excelDivide(elements, mostElements))
             formula = '=xpathOccurrence!' + '%s' % cell2
-            XpathAnalysisWS.write(0, col + 5, formula)
+            xpathSummary[0, col + 5] = (formula, None, _cellValue(header))
             dateFormula = (
                 '=LEFT(RIGHT(xpathOccurrence!' + '%s' % cell2 +
                 ',LEN(xpathOccurrence!' + '%s' % cell2 +
@@ -745,467 +2835,154 @@ def CombinationSpreadsheet(xpathOccurrence, recommendationOccurrence,
                 '%s' % cell2 + ')-1),FIND("_",xpathOccurrence!' +
                 '%s' % cell2 + ')+1)'
             )
-            XpathAnalysisWS.write(8, col + 5, dateFormula)
+            xpathSummary[8, col + 5] = (
+                dateFormula, None, _uploadDate(header, '_'))
             collectFormula = (
                 '=LEFT(xpathOccurrence!' + '%s' % cell2 +
                 ',FIND("_",xpathOccurrence!' + '%s' % cell2 + ')-1)'
             )
 
-            XpathAnalysisWS.write(9, col + 5, collectFormula)
+            xpathSummary[9, col + 5] = (
+                collectFormula, None, _headerCollection(header))
 
-        row_count += 1
     #######################################################################
 
     if xpathCounts is not None:
-        Reader = csv.reader(
-            open(xpathCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-
-        for row in Reader:
-            for col in range(len(row)):
-                xpathcounts.write(row_count, col, row[col], cell_format04)
-            row_count += 1
-        Reader = csv.reader(
-            open(xpathCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-        absRowCount = sum(1 for row in Reader)
-        absColCount = len(next(csv.reader(
-            open(xpathCounts, 'r'), delimiter=',', quotechar='"')))
-        xpathcounts.autofilter(0, 0, absRowCount - 1, absColCount - 1)
-
-    XpathAnalysisWS.write('A2', 'Number of Records')
-    XpathAnalysisWS.write('A3', 'Number of Elements / Attributes')
-    #XpathAnalysisWS.write(
-     #   'A4',
-      #  'Coverage w/r to Repository (CR): \
-     #number of elements / total number of elements'
+        countsRows = _reportRows(xpathCounts)
+        countsHeader = next(countsRows)
+        countsRowCount = _writeRows(xpathcounts, countsHeader, countsRows,
+                                    formats['whole'])
+        xpathcounts.autofilter(0, 0, countsRowCount - 1,
+                               len(countsHeader) - 1)
+
+    xpathSummary[1, 0] = ('Number of Records',)
+    xpathSummary[2, 0] = ('Number of Elements / Attributes',)
+    #xpathSummary[3, 0] = (
+     #   'Coverage w/r to Repository (CR): \
+     #number of elements / total number of elements',
     #)
-    #XpathAnalysisWS.write('A5', 'Average Occurrence Rate')
-    #XpathAnalysisWS.write('A6', 'Repository Completeness: Number of elements \
-    #/ number of elements in most complete collection in repository')
-    XpathAnalysisWS.write('A7', 'Complete Elements')
+    #xpathSummary[4, 0] = ('Average Occurrence Rate',)
+    #xpathSummary[5, 0] = ('Repository Completeness: Number of elements \
+    #/ number of elements in most complete collection in repository',)
+    xpathSummary[6, 0] = ('Complete Elements',)
     #/ Total Number of elements in the collection')
-    XpathAnalysisWS.write('A8', 'Partially Complete Elements')
-    XpathAnalysisWS.write('A9', 'Upload Date')
-    XpathAnalysisWS.write('C1', 'MIN')
-    XpathAnalysisWS.write('D1', 'MAX')
-    XpathAnalysisWS.write('E1', 'AVG')
-    XpathAnalysisWS.write('B10', 'Element Name')
-    XpathAnalysisWS.write('C10', 'Collections')
-    XpathAnalysisWS.write('D10', 'Complete')
-    XpathAnalysisWS.write('E10', 'Partial')
-
-    for row in range(1, 3):
-        absColCount = len(next(csv.reader(
-            open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'
-        )))
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 3 + absColCount)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 2, miniFormula, cell_format04)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 3, maxiFormula, cell_format04)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 4, avgFormula, cell_format04)
-
-    for row in range(6, 8):
-        absColCount = len(next(csv.reader(
-            open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'
-        )))
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 3 + absColCount)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 2, miniFormula, cell_format11)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 3, maxiFormula, cell_format11)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        XpathAnalysisWS.write(row, 4, avgFormula, cell_format11)
-
-    Reader = csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'
-    )
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"'
-    )))
-
-    XpathAnalysisWS.autofilter(9, 0, absRowCount + 7, absColCount + 3)
-    xpathoccurrenceWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
-    avgXpathOccurWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
-
-    XpathAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount +
-        3,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    XpathAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    XpathAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-    xpathoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    xpathoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    xpathoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-
-    xpathoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    xpathoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    xpathoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-
-
-    avgXpathOccurWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-    avgXpathOccurWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    avgXpathOccurWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-    for row in range(10, absRowCount + 8):
-        colRange5 = xlsxwriter.utility.xl_range(row, 5, row, absColCount + 3)
-        numbCollectFormula = '=COUNTIF(' + colRange5 + ',">"&0)'
-        CompleteCollectFormula = '=COUNTIF(' + colRange5 + ',"="&1)'
-        GreatCollectFormula = '=COUNTIF(' + colRange5 + ',"<"&1)-COUNTIF('+ colRange5 + ',"=0")'
-        XpathAnalysisWS.write(row, 2, numbCollectFormula)
-        XpathAnalysisWS.write(row, 3, CompleteCollectFormula)
-        XpathAnalysisWS.write(row, 4, GreatCollectFormula)
-
-    #######################################################################
-    Reader = csv.reader(
-        open(xpathOccurrence, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    for row in Reader:
-        for col in range(len(row) - 1):
-
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-            cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
-            colRange = xlsxwriter.utility.xl_range(2, col + 1, 5000, col + 1)
-            colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, len(row) + 3)
-
-
-            formula1 = (
-                '=VLOOKUP("Number of Records",xpathOccurrence!1:1048576,' +
-                str(col + 2) + ', False)'
-            )
-            XpathAnalysisWS.write(1, col + 5, formula1, cell_format04)
-
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-            formula2 = '=COUNTIF(xpathOccurrence!' + colRange + ',">"&0)'
-            XpathAnalysisWS.write(2, col + 5, formula2)
-            formula = '=xpathOccurrence!' + '%s' % cell2
-            XpathAnalysisWS.write(0, col + 5, formula)
-            formula6 = (
-                '=COUNTIF(xpathOccurrence!' +
-                colRange + ',">="&1)/' + '%s' % cell3
-            )
-            XpathAnalysisWS.write(6, col + 5, formula6, cell_format11)
-
-            formula7 = (
-                '=COUNTIFS(xpathOccurrence!' +
-                colRange + ',">"&0,xpathOccurrence!' +
-                colRange + ',"<"&1)/' + '%s' % cell3
-            )
-            XpathAnalysisWS.write(7, col + 5, formula7, cell_format11)
-            dateFormula = (
-                '=LEFT(RIGHT(xpathOccurrence!' + '%s' % cell2 +
-                ',LEN(xpathOccurrence!' + '%s' % cell2 +
-                ')-FIND("_", xpathOccurrence!' +
-                '%s' % cell2 + ')-1),FIND("__",xpathOccurrence!' +
-                '%s' % cell2 + ')+1)'
-            )
-            XpathAnalysisWS.write(8, col + 5, dateFormula)
-            collectFormula = (
-                '=LEFT(xpathOccurrence!' + '%s' % cell2 +
-                ',FIND("_",xpathOccurrence!' + '%s' % cell2 + ')-1)'
-            )
+    xpathSummary[7, 0] = ('Partially Complete Elements',)
+    xpathSummary[8, 0] = ('Upload Date',)
+    xpathSummary[0, 2] = ('MIN',)
+    xpathSummary[0, 3] = ('MAX',)
+    xpathSummary[0, 4] = ('AVG',)
+    xpathSummary[9, 1] = ('Element Name',)
+    xpathSummary[9, 2] = ('Collections',)
+    xpathSummary[9, 3] = ('Complete',)
+    xpathSummary[9, 4] = ('Partial',)
+
+    absColCount = len(xpathHeader)
+    _aggregateFormulas(xpathSummary, range(1, 3), 3 + absColCount,
+                       formats['whole'])
+    _aggregateFormulas(xpathSummary, range(6, 8), 3 + absColCount,
+                       formats['percent'])
 
-            XpathAnalysisWS.write(9, col + 5, collectFormula)
     #######################################################################
+    for col in range(len(xpathHeader) - 1):
+        header = _metric(xpathMetrics, 'Header', col)
+        elements = _metric(xpathMetrics, 'Elements', col)
+        completeElements = _excelDivide(
+            _metric(xpathMetrics, 'AtLeastComplete', col), elements)
+        partialElements = _excelDivide(
+            _metric(xpathMetrics, 'Partial', col), elements)
+        cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
+        cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
+        colRange = xlsxwriter.utility.xl_range(2, col + 1, SUMMARY_ROWS, col + 1)
+
+        formula1 = (
+            '=VLOOKUP("Number of Records",xpathOccurrence!1:1048576,' +
+            str(col + 2) + ', False)'
+        )
+        xpathSummary[1, col + 5] = (
+            formula1, formats['whole'], _metric(xpathMetrics, 'Records', col))
+
+        cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
+        formula2 = '=COUNTIF(xpathOccurrence!' + colRange + ',">"&0)'
+        xpathSummary[2, col + 5] = (formula2, None, elements)
+        formula = '=xpathOccurrence!' + '%s' % cell2
+        xpathSummary[0, col + 5] = (formula, None, _cellValue(header))
+        formula6 = (
+            '=COUNTIF(xpathOccurrence!' +
+            colRange + ',">="&1)/' + '%s' % cell3
+        )
+        xpathSummary[6, col + 5] = (formula6, formats['percent'], completeElements)
 
-    RecommendationAnalysisWS.set_column('A:A', 70)
-    RecommendationAnalysisWS.set_column('B:B', 20)
-
-    recommendationoccurrenceWS.set_column('A:A', 70)
-
-    Reader = csv.reader(
-        open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    recommendationoccurrenceWS.set_row(1, None, cell_format04)
-    for row in Reader:
-        for col in range(len(row)):
-            recommendationoccurrenceWS.write(
-                row_count, col, row[col])
-
-            recommendationoccurrenceWS.set_column(
-                col, col, 15, cell_format11)
-        row_count += 1
-    Reader = csv.reader(
-        open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    for row in Reader:
-        if Reader.line_num != 2:
-            for col in range(1, len(row)):
-                RecommendationAnalysisWS.write(
-                    row_count + 9, col + 4, row[col], cell_format11
-                )
-
-            for col in range(0, 1):
-                RecommendationAnalysisWS.write(
-                    row_count + 9, col, row[col], cell_format11)
-
-                Recommendationcell = xlsxwriter.utility.xl_rowcol_to_cell(
-                    row_count + 9, 0)
-                formulaElementSimplifier = (
-                    '=MID(' + Recommendationcell +
-                    ',1+FIND("|",SUBSTITUTE(' + Recommendationcell +
-                    ',"/","|",LEN(' + Recommendationcell + ')-LEN(SUBSTITUTE(' +
-                    Recommendationcell + ',"/","")))),100)'
-                )
-                RecommendationAnalysisWS.write(
-                    row_count + 9, col + 1, formulaElementSimplifier, cell_format11
-                )
-            row_count += 1
-
-    avgRecommendationOccurWS.set_column('A:A', 70)
-    if AVGrecommendationOccurrence is not None:
-        Reader = csv.reader(
-            open(AVGrecommendationOccurrence, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-        avgRecommendationOccurWS.set_row(1, None, cell_format04)
-        for row in Reader:
-            for col in range(len(row)):
-                avgRecommendationOccurWS.write(
-                    row_count, col, row[col])
-                avgRecommendationOccurWS.set_column(col, col, 15, cell_format05)
-    RecommendationAnalysisWS.write('A2', 'Number of records')
-    RecommendationAnalysisWS.write('A3', 'Number of elements')
-    RecommendationAnalysisWS.write(
-        'A4',
-        'Number of recommendation elements'
-    )
-    RecommendationAnalysisWS.write('A5', 'Recommendation focus')
-    RecommendationAnalysisWS.write('A6', 'Complete elements in the collection')
-    RecommendationAnalysisWS.write('A7', 'Complete recommendation elements in the collection')
-    RecommendationAnalysisWS.write(
-        'A8', 'Recommendation completeness focus')
-    RecommendationAnalysisWS.write('A9', 'Upload Date')
-    RecommendationAnalysisWS.write('B1', 'Formulas')
-    RecommendationAnalysisWS.write('C1', 'MIN')
-    RecommendationAnalysisWS.write('D1', 'MAX')
-    RecommendationAnalysisWS.write('E1', 'AVG')
-    RecommendationAnalysisWS.write('B10', 'Element Name')
-    RecommendationAnalysisWS.write('C10', 'Collections')
-    RecommendationAnalysisWS.write('D10', 'Complete')
-    RecommendationAnalysisWS.write('E10', 'Partial')
-
-    Reader = csv.reader(
-        open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"')
-
-    row_count = 0
-    for row in Reader:
-        for col in range(len(row) - 1):
-            ElementTotal = xlsxwriter.utility.xl_rowcol_to_cell(5, col + 5)
-            RecommendationElementTotal = xlsxwriter.utility.xl_rowcol_to_cell(6, col + 5)
-            cell2 = xlsxwriter.utility.xl_rowcol_to_cell(0, col + 1)
-            cell3 = xlsxwriter.utility.xl_rowcol_to_cell(2, col + 5)
-            cell4 = xlsxwriter.utility.xl_rowcol_to_cell(3, col + 5)
-            colRange = xlsxwriter.utility.xl_range(2, col + 1, 5000, col + 1)
-            colRange2 = xlsxwriter.utility.xl_range(2, 5, 2, len(row) + 3)
-
-            formula2 = '=COUNTIF(XpathOccurrence!' + colRange + ',">"&0)'
-            RecommendationAnalysisWS.write(2, col + 5, formula2)
-
-            formula3 = '=COUNTIF(BestPractices2004_Occurrence!' + colRange + ',">"&0)'
-            RecommendationAnalysisWS.write(3, col + 5, formula3)
-
-            formula4 = '='+cell4+'/'+cell3
-            RecommendationAnalysisWS.write(4, col + 5, formula4, cell_format11)
-
-            formula5 = '=COUNTIF(XpathOccurrence!' + colRange + ',"=1")/'+cell3 
-            RecommendationAnalysisWS.write(5, col + 5, formula5, cell_format11)
-
-            formula6 = '=COUNTIF(BestPractices2004_Occurrence!' + colRange + ',"=1")/'+cell3
-            RecommendationAnalysisWS.write(6, col + 5, formula6, cell_format11)
-
-            formula7 = '='+RecommendationElementTotal+'/'+ElementTotal
-            RecommendationAnalysisWS.write(7, col + 5, formula7, cell_format11)
-
-            formula1 = (
-                '=VLOOKUP("Number of Records",BestPractices2004_Occurrence!1:1048576,' +
-                str(col + 2) + ', False)'
-            )
-            RecommendationAnalysisWS.write(1, col + 5, formula1, cell_format04)
+        formula7 = (
+            '=COUNTIFS(xpathOccurrence!' +
+            colRange + ',">"&0,xpathOccurrence!' +
+            colRange + ',"<"&1)/' + '%s' % cell3
+        )
+        xpathSummary[7, col + 5] = (formula7, formats['percent'], partialElements)
+        dateFormula = (
+            '=LEFT(RIGHT(xpathOccurrence!' + '%s' % cell2 +
+            ',LEN(xpathOccurrence!' + '%s' % cell2 +
+            ')-FIND("_", xpathOccurrence!' +
+            '%s' % cell2 + ')-1),FIND("__",xpathOccurrence!' +
+            '%s' % cell2 + ')+1)'
+        )
+        xpathSummary[8, col + 5] = (
+            dateFormula, None, _uploadDate(header, '__'))
+        collectFormula = (
+            '=LEFT(xpathOccurrence!' + '%s' % cell2 +
+            ',FIND("_",xpathOccurrence!' + '%s' % cell2 + ')-1)'
+        )
 
-            formula = '=BestPractices2004_Occurrence!' + '%s' % cell2
-            RecommendationAnalysisWS.write(0, col + 5, formula)
-            dateFormula = (
-                '=LEFT(RIGHT(BestPractices2004_Occurrence!' + '%s' % cell2 +
-                ',LEN(BestPractices2004_Occurrence!' + '%s' % cell2 +
-                ')-FIND("_", BestPractices2004_Occurrence!' +
-                '%s' % cell2 + ')-1),FIND("_",BestPractices2004_Occurrence!' +
-                '%s' % cell2 + ')+1)'
-            )
-            RecommendationAnalysisWS.write(8, col + 5, dateFormula)
-            collectFormula = (
-                '=LEFT(BestPractices2004_Occurrence!' + '%s' % cell2 +
-                ',FIND("_",BestPractices2004_Occurrence!' + '%s' % cell2 + ')-1)'
-            )
+        xpathSummary[9, col + 5] = (
+            collectFormula, None, _headerCollection(header))
+    _aggregateValues(xpathSummary, (1, 2, 6, 7), 3 + absColCount)
 
-            RecommendationAnalysisWS.write(9, col + 5, collectFormula)
+    _writeCells(XpathAnalysisWS, xpathSummary, formulas, cachedValues)
+    xpathoccurrenceWS.set_row(1, None, formats['whole'])
+    absRowCount = _writeOccurrenceRows(
+        xpathoccurrenceWS, XpathAnalysisWS, xpathOccurrence, formats['percent'],
+        formulas, cachedValues)
 
-        row_count += 1
-    #######################################################################
+    XpathAnalysisWS.autofilter(9, 0, absRowCount + 7, absColCount + 3)
+    xpathoccurrenceWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
+    avgXpathOccurWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
 
-    if recommendationCounts is not None:
-        Reader = csv.reader(
-            open(recommendationCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-
-        for row in Reader:
-            for col in range(len(row)):
-                recommendationcounts.write(
-                    row_count, col, row[col], cell_format04)
-            row_count += 1
-        Reader = csv.reader(
-            open(recommendationCounts, 'r'), delimiter=',', quotechar='"')
-        row_count = 0
-        absRowCount = sum(1 for row in Reader)
-        absColCount = len(next(csv.reader(
-            open(recommendationCounts, 'r'), delimiter=',', quotechar='"')))
-        recommendationcounts.autofilter(0, 0, absRowCount - 1, absColCount - 1)
+    _conditionalFormats(XpathAnalysisWS, 10, 5, absRowCount + 8,
+                        absColCount + 3, formats)
+    _conditionalFormats(xpathoccurrenceWS, 2, 1, absRowCount - 1,
+                        absColCount - 1, formats)
+    _conditionalFormats(avgXpathOccurWS, 2, 1, absRowCount - 1,
+                        absColCount - 1, formats)
+    workbook.close()
 
-    
-    for row in range(1, 4):
-        absColCount = len(next(csv.reader(
-            open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"'
-        )))
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 3 + absColCount)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        RecommendationAnalysisWS.write(row, 2, miniFormula, cell_format04)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        RecommendationAnalysisWS.write(row, 3, maxiFormula, cell_format04)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        RecommendationAnalysisWS.write(row, 4, avgFormula, cell_format04)
-
-    for row in range(4, 8):
-        absColCount = len(next(csv.reader(
-            open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"'
-        )))
-        colRange4 = xlsxwriter.utility.xl_range(row, 5, row, 3 + absColCount)
-        miniFormula = '=MIN(' + colRange4 + ')'
-        RecommendationAnalysisWS.write(row, 2, miniFormula, cell_format11)
-        maxiFormula = '=MAX(' + colRange4 + ')'
-        RecommendationAnalysisWS.write(row, 3, maxiFormula, cell_format11)
-        avgFormula = '=AVERAGE(' + colRange4 + ')'
-        RecommendationAnalysisWS.write(row, 4, avgFormula, cell_format11)
-
-    Reader = csv.reader(
-        open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"'
-    )
-    absRowCount = sum(1 for row in Reader)
-    absColCount = len(next(csv.reader(
-        open(recommendationOccurrence, 'r'), delimiter=',', quotechar='"'
-    )))
-
-    RecommendationAnalysisWS.autofilter(9, 0, absRowCount + 7, absColCount + 3)
-    recommendationoccurrenceWS.autofilter(
-        0, 0, absRowCount - 2, absColCount - 1)
-    avgRecommendationOccurWS.autofilter(0, 0, absRowCount - 2, absColCount - 1)
-
-    RecommendationAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount +
-        3,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    RecommendationAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    RecommendationAnalysisWS.conditional_format(
-        10, 5, absRowCount + 8, absColCount + 3,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-    recommendationoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    recommendationoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    recommendationoccurrenceWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-    avgRecommendationOccurWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen})
-    avgRecommendationOccurWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow})
-    avgRecommendationOccurWS.conditional_format(
-        2, 1, absRowCount - 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed})
-
-    RecommendationConceptWS.conditional_format(
-        3, 3, 28, absColCount + 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    RecommendationConceptWS.conditional_format(
-        3, 3, 28, absColCount + 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    RecommendationConceptWS.conditional_format(
-        3, 3, 28, absColCount + 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-    RecommendationConceptWS.conditional_format(
-        1, 3, 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '>=', 'value': 1, 'format': formatGreen}
-    )
-    RecommendationConceptWS.conditional_format(
-        1, 3, 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': 0, 'format': formatYellow}
-    )
-    RecommendationConceptWS.conditional_format(
-        1, 3, 1, absColCount - 1,
-        {'type': 'cell', 'criteria': '=', 'value': -1, 'format': formatRed}
-    )
-    for row in range(10, absRowCount + 8):
-        colRange5 = xlsxwriter.utility.xl_range(row, 5, row, absColCount + 3)
-        numbCollectFormula = '=COUNTIF(' + colRange5 + ',">"&0)'
-        CompleteCollectFormula = '=COUNTIF(' + colRange5 + ',"="&1)'
-        GreatCollectFormula = '=COUNTIF(' + colRange5 + ',"<"&1)-COUNTIF('+ colRange5 + ',"=0")'
-        RecommendationAnalysisWS.write(row, 2, numbCollectFormula)
-        RecommendationAnalysisWS.write(row, 3, CompleteCollectFormula)
-        RecommendationAnalysisWS.write(row, 4, GreatCollectFormula)
 
-    #######################################################################
-    
-    #######################################################################
-    workbook.close()
+def CombinationSpreadsheet(xpathOccurrence, recommendationOccurrence,
+                           RecommendationConcept, RecommendationGraph,
+                           RecGraphLink,
+                           DataDestination, AVGxpathOccurrence=None,
+                           AVGrecommendationOccurrence=None,
+                           recommendationCounts=None, xpathCounts=None,
+                           recommendationOccurrence2=None,
+                           RecommendationConcept2=None, RecommendationGraph2=None,
+                           RecGraphLink2=None, AVGrecommendationOccurrence2=None,
+                           recommendationCounts2=None, constantMemory=False,
+                           formulas=True, cachedValues=False):
+    """The report of the BestPractices2004 recommendation and, with
+    recommendationOccurrence2, the BestPractices2011 recommendation; see
+    RecommendationSpreadsheet for any others.
+    """
+    recommendations = [RecommendationResults(
+        'BestPractices2004', recommendationOccurrence, RecommendationConcept,
+        RecommendationGraph, RecGraphLink, AVGrecommendationOccurrence,
+        recommendationCounts)]
+    if recommendationOccurrence2 is not None:
+        recommendations.append(RecommendationResults(
+            'BestPractices2011', recommendationOccurrence2,
+            RecommendationConcept2, RecommendationGraph2, RecGraphLink2,
+            AVGrecommendationOccurrence2, recommendationCounts2))
+    RecommendationSpreadsheet(recommendations, xpathOccurrence,
+                              DataDestination, AVGxpathOccurrence,
+                              xpathCounts, constantMemory, formulas,
+                              cachedValues)
 
 
 def WriteToGoogle(SpreadsheetLocation, folderID=None, Convert=None, Link=None):
@@ -1289,10 +3066,12 @@ def Site_ttConceptAnalysis(Site, recommendationName, RecDict, LevelOrder, Concep
     recOccurDF.insert(0, "RecLevel", 0, allow_duplicates=False)    
     recOccurDF.insert(0, "RecConcept", 0, allow_duplicates=False)
     ''' 
-    use the RecDict to look at the XPath column and for each key that matches part of any cell,
+    use the RecDict to look at the XPath column and for the most specific key that matches part of any cell,
     write the value into the same row in the recOccurDF
     '''
-    recOccurDF['RecElement'] = recOccurDF['XPath'].apply(lambda x: [value for key, value in RecDict.items() if key in x][0] )
+    recOccurDF['RecElement'] = recOccurDF[['XPath']].merge(
+        recElementMapping(RecDict, recOccurDF['XPath']), on='XPath',
+        how='left')['RecElement'].to_numpy()
     # create a list to order the columns with
     columnOrder = list(recOccurDF)
     # don't need xpaths any more
@@ -1711,6 +3490,168 @@ def Site_ttConceptAnalysis(Site, recommendationName, RecDict, LevelOrder, Concep
     os.remove(os.path.join('..','data', recommendationName, Site+ recommendationName + '_bigPict_.png'))
 
 
+RecommendationOrder = collections.namedtuple(
+    'RecommendationOrder',
+    ['RecDict', 'LevelOrder', 'ConceptOrder', 'ElementOrder'])
+RecommendationOrder.__doc__ = """The elements of a recommendation and the
+order of its levels, concepts and elements, as Site_ttConceptAnalysis
+takes them.
+"""
+
+
+def _reportLocations(sites, ReportDirectory):
+    """A report in ``ReportDirectory`` for each site, named after the site
+    with the characters a file name cannot hold replaced, and numbered
+    where two sites would otherwise share a file, ignoring case.
+    """
+    locations = []
+    taken = set()
+    for Site in sites:
+        name = re.sub(r'[^\w.-]', '_', Site)
+        candidate, number = name, 1
+        while candidate.lower() in taken:
+            number += 1
+            candidate = '%s_%d' % (name, number)
+        taken.add(candidate.lower())
+        locations.append(
+            os.path.join(ReportDirectory, candidate + '_Report.xlsx'))
+    return locations
+
+
+def _siteReport(task):
+    """Build the concept analyses, radar images and report of a site in a
+    worker process. The report is written next to its destination and
+    moved there once it is complete. Errors are logged and returned rather
+    than raised, with how long each step took, so that one site cannot
+    stop the others.
+    """
+    (Site, recommendations, YearsInvestigated, DataDirectory,
+     DataDestination, options) = task
+    timings = {'Concepts': None, 'Spreadsheet': None}
+    start = time.perf_counter()
+    partial = DataDestination + '.partial'
+    try:
+        results = []
+        for recommendationName, order in recommendations.items():
+            Site_ttConceptAnalysis(Site, recommendationName, *order,
+                                   YearsInvestigated)
+            location = os.path.join('..', 'data', recommendationName,
+                                    Site + '_' + recommendationName)
+            results.append(RecommendationResults(
+                recommendationName,
+                _recommendationLocations(recommendationName, Site)[1],
+                location + 'Completeness.csv', location + '_.png',
+                os.path.join('..', 'data', recommendationName,
+                             Site + recommendationName + '_bigPicture_.png')))
+        concepts = time.perf_counter()
+        timings['Concepts'] = concepts - start
+        RecommendationSpreadsheet(
+            results, os.path.join(DataDirectory,
+                                  Site + '_XpathOccurrence.csv'),
+            partial, **options)
+        os.replace(partial, DataDestination)
+        timings['Spreadsheet'] = time.perf_counter() - concepts
+        error = None
+    except Exception as err:
+        lggr.warning('Report of %s failed: %s' % (Site, err))
+        error = '%s: %s' % (type(err).__name__, err)
+        if os.path.exists(partial):
+            os.remove(partial)
+    return timings, time.perf_counter() - start, error
+
+
+def reportSites(sites, recommendations, YearsInvestigated, ReportDirectory,
+                DataDirectory=os.path.join('..', 'data'), workers=None,
+                constantMemory=True, formulas=True, cachedValues=False):
+    """Build the reports of several sites in parallel across a pool of
+    ``workers`` processes (default: one per core). For each site the
+    concept analyses and radar images of ``recommendations``, which maps
+    recommendation names to their RecommendationOrder, are made with
+    Site_ttConceptAnalysis and written with RecommendationSpreadsheet,
+    along with the site's ``<Site>_XpathOccurrence.csv`` from
+    ``DataDirectory``, to a report of its own in ``ReportDirectory``.
+    Sites listed twice are reported once. A site that fails is logged and
+    does not stop the others. Returns a dataframe of each site's report,
+    whether it was written and the seconds its concept analyses, its
+    spreadsheet and the whole report took.
+    """
+    os.makedirs(ReportDirectory, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    sites = list(dict.fromkeys(sites))
+    locations = _reportLocations(sites, ReportDirectory)
+    options = {'constantMemory': constantMemory, 'formulas': formulas,
+               'cachedValues': cachedValues}
+
+    lggr.info('Reporting %d sites' % len(sites))
+    start = time.perf_counter()
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_siteReport, (Site, recommendations,
+                                          YearsInvestigated, DataDirectory,
+                                          DataDestination, options))
+            for Site, DataDestination in zip(sites, locations)]
+        for Site, DataDestination, future in zip(sites, locations, futures):
+            try:
+                timings, seconds, error = future.result()
+            except Exception as err:
+                # the worker itself was lost, as when it runs out of memory
+                timings = {'Concepts': None, 'Spreadsheet': None}
+                seconds, error = None, '%s: %s' % (type(err).__name__, err)
+            rows.append({'Site': Site, 'Report': DataDestination,
+                         'Status': 'failed' if error else 'written',
+                         'Concepts': timings['Concepts'],
+                         'Spreadsheet': timings['Spreadsheet'],
+                         'Seconds': seconds, 'Error': error})
+    summary = pd.DataFrame(rows, columns=['Site', 'Report', 'Status',
+                                          'Concepts', 'Spreadsheet',
+                                          'Seconds', 'Error'])
+    lggr.info('Reported %d of %d sites in %.1f seconds'
+              % ((summary['Status'] == 'written').sum(), len(sites),
+                 time.perf_counter() - start))
+    return summary
+
+
+_recElementMappings = {}
+
+
+def recElementMapping(RecDict, xpaths):
+    """Resolve each distinct XPath of ``xpaths`` to the recommendation
+    element ``RecDict`` gives for the keys it contains. When several keys
+    match, the most specific wins: the one matching deepest into the XPath,
+    then the longest. XPaths are resolved once per RecDict and the result
+    is cached for the other sites and analyses; XPaths no key matches are
+    logged and get no element. Returns a dataframe of XPath and RecElement.
+    """
+    cacheKey = tuple(RecDict.items())
+    if cacheKey not in _recElementMappings:
+        _recElementMappings[cacheKey] = (
+            RecommendationMatcher(RecDict.keys()), {})
+    matcher, resolved = _recElementMappings[cacheKey]
+    keys = matcher.elements
+    values = list(RecDict.values())
+
+    xpaths = pd.unique(pd.Series(xpaths, dtype=object))
+    for xpath in xpaths:
+        if xpath in resolved:
+            continue
+        ends = matcher.matchEnds(xpath)
+        if not ends:
+            resolved[xpath] = None
+            continue
+        best = max(ends, key=lambda index: (ends[index], len(keys[index])))
+        resolved[xpath] = values[best]
+    unmatched = [xpath for xpath in xpaths if resolved[xpath] is None]
+    if unmatched:
+        lggr.warning('No recommendation element for %d XPaths: %s'
+                     % (len(unmatched), ', '.join(unmatched)))
+
+    return pd.DataFrame({
+        'XPath': xpaths,
+        'RecElement': [resolved[xpath] for xpath in xpaths]})
+
+
 def CombineAppliedRecommendation(Site, recElements, recommendationName, RecommendationOccurrenceToCombine, RecommendationcountsToCombine=None):
     # places for all the combined data
 
@@ -1730,27 +3671,11 @@ def CombineAppliedRecommendation(Site, recElements, recommendationName, Recommen
                            RecommendationOccurrence, to_csv=True)
     RecommendationOccurrenceDF = pd.read_csv(RecommendationOccurrence)
     # change order of rows to be meaningful for recommendation
-    CollectionRecRows = []
-    CollectionRecRows.append(["Number of Records"])
-
-    CollectionRecColumns = []
-    CollectionRecColumns.append(["Collection","Record"])
-    for element in recElements:
-
-        # find the rows that match each element
-        CollectionElements = list(RecommendationOccurrenceDF['XPath'])[1:]
-
-        matchingElements = [CollectionElement for CollectionElement in CollectionElements if element in CollectionElement]
-
-        #append the list to a master list that will be used to order the chart
-        CollectionRecRows.append(matchingElements)
-        CollectionRecColumns.append(matchingElements)
-
-    CollectionRecRows = [item for sublist in CollectionRecRows for item in sublist]
-    CollectionRecColumns = [item for sublist in CollectionRecColumns for item in sublist]
-    from collections import OrderedDict
-    CollectionRecRows = list(OrderedDict.fromkeys(CollectionRecRows))
-    CollectionRecColumns = list(OrderedDict.fromkeys(CollectionRecColumns))
+    recommendationOrder = _recommendationOrder(
+        RecommendationMatcher(recElements),
+        list(RecommendationOccurrenceDF['XPath'])[1:])
+    CollectionRecRows = ["Number of Records"] + recommendationOrder
+    CollectionRecColumns = ["Collection", "Record"] + recommendationOrder
     if RecommendationcountsToCombine is not None:
         RecommendationCountsDF = RecommendationCountsDF[CollectionRecColumns]
     
@@ -1774,10 +3699,12 @@ def Collection_ConceptAnalysis(Site, recommendationName, RecDict, LevelOrder, Co
     recOccurDF.insert(0, "RecLevel", 0, allow_duplicates=False)    
     recOccurDF.insert(0, "RecConcept", '', allow_duplicates=False)
     ''' 
-    use the RecDict to look at the XPath column and for each key that matches part of any cell,
+    use the RecDict to look at the XPath column and for the most specific key that matches part of any cell,
     write the value into the same row in the recOccurDF
     '''
-    recOccurDF['RecElement'] = recOccurDF['XPath'].apply(lambda x: [value for key, value in RecDict.items() if key in x][0] )
+    recOccurDF['RecElement'] = recOccurDF[['XPath']].merge(
+        recElementMapping(RecDict, recOccurDF['XPath']), on='XPath',
+        how='left')['RecElement'].to_numpy()
     # create a list to order the columns with
     columnOrder = list(recOccurDF)
     # don't need xpaths any more
@@ -0,0 +1,49 @@
+import csv
+import gzip
+import importlib.util
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+EARMD = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'EARmd.py')
+
+
+@pytest.fixture(scope='module')
+def md():
+    spec = importlib.util.spec_from_file_location('EARmd', EARMD)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError as err:
+        pytest.skip('EARmd dependencies are not installed: %s' % err)
+    return module
+
+
+ROWS = [['LTER', 'r1', '/eml/dataset/title', '001'],
+        ['LTER', 'r1', '/eml/dataset/pubDate', '1.50'],
+        ['LTER', 'r2', '/eml/dataset/title', '12345678901234567890123'],
+        ['LTER', 'r2', '/eml/dataset/abstract', ''],
+        ['LTER', 'r3', '/eml/dataset/keyword', 'NA'],
+        ['LTER', 'r3', '/eml/dataset/intellectualRights', '1e5']]
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.csv.gz'])
+@pytest.mark.parametrize('columns', [None, ['Record', 'XPath']])
+def test_engines_read_the_same_frame(md, tmp_path, suffix, columns):
+    location = str(tmp_path / ('LTER_XpathEvaluated' + suffix))
+    opener = gzip.open if suffix.endswith('.gz') else open
+    with opener(location, 'wt', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(md.EVALUATED_COLUMNS)
+        writer.writerows(ROWS)
+
+    c = md.readEvaluated(location, columns)
+    arrow = md.readEvaluated(location, columns, engine='pyarrow')
+
+    pd.testing.assert_frame_equal(c, arrow)
+    if columns is None:
+        assert list(arrow['Content'][:3]) == [
+            '001', '1.50', '12345678901234567890123']
@@ -0,0 +1,105 @@
+import csv
+import importlib.util
+import os
+import tarfile
+
+import pytest
+
+EARMD = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'EARmd.py')
+
+
+@pytest.fixture(scope='module')
+def md():
+    spec = importlib.util.spec_from_file_location('EARmd', EARMD)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError as err:
+        pytest.skip('EARmd dependencies are not installed: %s' % err)
+    return module
+
+
+RECORDS = {'a.xml': '<eml><title>A</title><keyword>a</keyword></eml>',
+           'b.xml': '<eml><title>B</title></eml>',
+           'c.xml': '<eml><title>C</title><abstract>c</abstract></eml>'}
+
+
+def _tarball(location, records, source):
+    os.makedirs(source, exist_ok=True)
+    with tarfile.open(location, 'w:gz') as archive:
+        for name, content in records:
+            path = os.path.join(source, name)
+            with open(path, 'w') as f:
+                f.write(content)
+            archive.add(path, name)
+
+
+def _rows(location):
+    with open(location, newline='') as f:
+        return sorted(csv.reader(f))
+
+
+def test_update_of_a_reordered_archive_keeps_every_record(md, tmp_path):
+    archive = str(tmp_path / 'LTER.tar.gz')
+    store = str(tmp_path / 'LTER_XpathEvaluated.csv')
+    _tarball(archive, sorted(RECORDS.items()), str(tmp_path / 'before'))
+    md.evaluateCollection(archive, store)
+
+    records = dict(RECORDS, **{'b.xml': '<eml><title>B2</title></eml>'})
+    _tarball(archive, sorted(records.items(), reverse=True),
+             str(tmp_path / 'after'))
+    assert md.updateCollection(archive, store)
+
+    fresh = str(tmp_path / 'fresh.csv')
+    md.evaluateCollection(archive, fresh, 'LTER')
+    assert _rows(store) == _rows(fresh)
+    assert md.readManifest(store)['Records'] == md.readManifest(fresh)['Records']
+
+
+class _Response:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, content):
+        self.content = content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+
+class _Session:
+    def __init__(self, records):
+        self.records = records
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        return _Response(self.records[url].encode())
+
+
+def test_update_of_a_harvested_archive_keeps_every_record(md, tmp_path):
+    names = ['zeta', 'alpha', 'mid']
+    archive = str(tmp_path / 'LTER')
+    store = str(tmp_path / 'LTER_XpathEvaluated.csv')
+    md.harvestCollection(
+        names, names, store, 'LTER', archiveDirectory=archive,
+        session=_Session({name: '<eml><title>%s</title></eml>' % name
+                          for name in names}))
+
+    with open(os.path.join(archive, 'mid.xml'), 'w') as f:
+        f.write('<eml><title>mid</title><abstract>changed</abstract></eml>')
+    assert md.updateCollection(archive, store, 'LTER')
+
+    fresh = str(tmp_path / 'fresh.csv')
+    md.evaluateCollection(archive, fresh, 'LTER')
+    assert _rows(store) == _rows(fresh)